@@ -1,17 +1,120 @@
 import httpx
+import asyncio
 import base64
-import gzip
+import os
+import tempfile
+import threading
 import zipfile
 
-from io import BytesIO
-from typing import Literal, AsyncGenerator
+from collections import deque
+from typing import Literal, AsyncGenerator, Deque, Iterable, Optional
 from datetime import datetime, timedelta
 
+try:
+    # ISA-L based gzip is a drop-in replacement, 2-4x faster on x86
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
 from app.config.settings import settings
 from app.config.logger import get_logger
+from app.http_client import get_http_client
 
 logger = get_logger(__name__)
 
+# Amplitude export of a single day may take a long time to be prepared
+EXPORT_TIMEOUT = 2000
+
+# Lines are handed from the decompression thread to the event loop in batches
+LINES_PER_BATCH = 1000
+# Max number of batches buffered between the thread and the consumer
+QUEUE_MAX_BATCHES = 64
+
+
+def _decompress_to_queue(
+    zip_path: str,
+    queue: asyncio.Queue,
+    loop: asyncio.AbstractEventLoop,
+    stop: threading.Event,
+) -> None:
+    """
+    Runs in a worker thread: stream-decompress every .gz member of a daily
+    Amplitude zip and put batches of non-empty lines into ``queue``.
+    An exception (if any) is forwarded as an item; ``None`` marks the end.
+    """
+
+    def put(item) -> None:
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    try:
+        batch = []
+        with zipfile.ZipFile(zip_path, "r") as daily_zip:
+            for info in daily_zip.infolist():
+                if not info.filename.endswith(".gz"):
+                    continue
+                # Stream-decompress .gz → JSON lines without reading it whole
+                with (
+                    daily_zip.open(info) as raw,
+                    gzip.GzipFile(fileobj=raw, mode="rb") as gz,
+                ):
+                    for line in gz:
+                        line = line.strip()
+                        if line:
+                            batch.append(line)
+                        if len(batch) >= LINES_PER_BATCH:
+                            put(batch)
+                            batch = []
+                            if stop.is_set():
+                                return
+        if batch:
+            put(batch)
+    except BaseException as e:
+        put(e)
+    finally:
+        put(None)
+
+
+async def _iter_zip_lines(zip_path: str) -> AsyncGenerator[bytes, None]:
+    """
+    Yield JSON lines from every .gz member of a daily Amplitude zip.
+    Decompression runs in a thread so the event loop is not blocked.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_MAX_BATCHES)
+    stop = threading.Event()
+    fut = loop.run_in_executor(None, _decompress_to_queue, zip_path, queue, loop, stop)
+    finished = False
+    try:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                finished = True
+                break
+            if isinstance(batch, BaseException):
+                raise batch
+            for line in batch:
+                yield line
+    finally:
+        if not finished:
+            # Let the thread notice the stop flag and drain until it is done
+            stop.set()
+            while await queue.get() is not None:
+                pass
+        await fut
+
+
+async def _discard_tasks(tasks: Iterable[asyncio.Task]) -> None:
+    """Cancel unfinished download tasks and remove files of the finished ones."""
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            path = await task
+        except BaseException:
+            continue
+        if os.path.exists(path):
+            os.remove(path)
+
 
 class AmplitudeClient:
     """
@@ -30,56 +133,99 @@ class AmplitudeClient:
             self.client_id = settings.amplitude.mobile_client_id
         if not self.secret_key or not self.client_id:
             raise ValueError(f"Amplitude credentials for {source} not set in settings")
-
-    def _get_auth_header(self) -> str:
         token = f"{self.client_id}:{self.secret_key}"
-        return "Basic " + base64.b64encode(token.encode()).decode()
+        self._auth_headers = {
+            "Authorization": "Basic " + base64.b64encode(token.encode()).decode()
+        }
 
-    async def export(self, start: str, end: str) -> bytes:
+    async def export_to_file(
+        self, start: str, end: str, client: Optional[httpx.AsyncClient] = None
+    ) -> str:
         """
-        Export data from Amplitude API for the given date range.
+        Stream an Amplitude export for the given date range to a temporary file.
         Args:
             start: Start date in format YYYYMMDDTHH (e.g. 20200201T00)
             end: End date in format YYYYMMDDTHH (e.g. 20200207T23)
+            client: Optional httpx client (the shared one is used if omitted)
         Returns:
-            Raw zip file bytes
+            Path to the temporary zip file (caller is responsible for removing it)
         """
-        headers = {"Authorization": self._get_auth_header()}
+        client = client or get_http_client()
+
+        headers = self._auth_headers
         params = {"start": start, "end": end}
-        async with httpx.AsyncClient(timeout=2000) as client:
-            response = await client.get(self.BASE_URL, headers=headers, params=params)
-            response.raise_for_status()
-            return response.content
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
+        try:
+            async with client.stream(
+                "GET",
+                self.BASE_URL,
+                headers=headers,
+                params=params,
+                timeout=EXPORT_TIMEOUT,
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(chunk_size=1 << 20):
+                    tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        tmp.close()
+        return tmp.name
 
-    async def export_day(self, date_str: str) -> bytes:
-        """Export a single day (00:00 – 23:59)."""
-        return await self.export(f"{date_str}T00", f"{date_str}T23")
+    async def export_day_to_file(
+        self, date_str: str, client: Optional[httpx.AsyncClient] = None
+    ) -> str:
+        """Export a single day (00:00 – 23:59) into a temporary zip file."""
+        return await self.export_to_file(
+            f"{date_str}T00", f"{date_str}T23", client=client
+        )
 
     async def iter_lines(
         self, start: datetime, end: datetime
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[bytes, None]:
         """
         Yield one JSON line per event for the inclusive date range [start, end].
-        Each line is a string containing a complete JSON object.
+        Each line is raw UTF-8 bytes of a complete JSON object (without newline);
+        lines are passed through as-is, without decoding.
+
+        Days are downloaded concurrently, but lines are always yielded in
+        chronological order. At most ``settings.amplitude.max_parallel_days``
+        days are in flight or on disk at a time: the next day is started only
+        after the oldest one has been consumed and its file removed.
         """
-        current = start
-        while current <= end:
-            day_str = current.strftime("%Y%m%d")
+        days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        if not days:
+            return
+
+        day_strs = (day.strftime("%Y%m%d") for day in days)
+        window = settings.amplitude.max_parallel_days
+        pending: Deque[asyncio.Task] = deque()
+
+        async def _fetch(day_str: str) -> str:
             try:
-                zip_bytes = await self.export_day(day_str)
+                return await self.export_day_to_file(day_str)
             except Exception as e:
                 logger.error(f"Failed to export {day_str}: {e}")
                 raise
 
-            with zipfile.ZipFile(BytesIO(zip_bytes), "r") as daily_zip:
-                for gz_name in daily_zip.namelist():
-                    if not gz_name.endswith(".gz"):
-                        continue
-                    with daily_zip.open(gz_name) as gz_file:
-                        # Decompress .gz → JSON lines
-                        json_bytes = gzip.decompress(gz_file.read())
-                        text = json_bytes.decode("utf-8")
-                        for line in text.splitlines():
-                            if line.strip():
-                                yield line
-            current += timedelta(days=1)
+        def _fill_window() -> None:
+            while len(pending) < window:
+                day_str = next(day_strs, None)
+                if day_str is None:
+                    return
+                pending.append(asyncio.create_task(_fetch(day_str)))
+
+        _fill_window()
+        try:
+            while pending:
+                zip_path = await pending[0]
+                try:
+                    async for line in _iter_zip_lines(zip_path):
+                        yield line
+                finally:
+                    os.remove(zip_path)
+                pending.popleft()
+                _fill_window()
+        finally:
+            await _discard_tasks(pending)
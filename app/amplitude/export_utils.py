@@ -1,35 +1,79 @@
+import asyncio
 import os
 import tempfile
+import threading
 import zipfile
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
+
+# Lines are accumulated and flushed to disk in ~1 MiB portions
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+class _ZipEntryWriter:
+    """
+    Writes one ZIP entry from worker threads (asyncio.to_thread), so compression
+    and disk I/O stay off the event loop. The lock keeps close() from running
+    while a write abandoned by a cancelled request is still in progress.
+    """
+
+    def __init__(self, path: str, filename: str, compression: int, compresslevel):
+        self._lock = threading.Lock()
+        self._zf = zipfile.ZipFile(path, "w", compression, compresslevel=compresslevel)
+        self._entry = self._zf.open(filename, "w", force_zip64=True)
+
+    def write(self, data: bytes) -> None:
+        with self._lock:
+            self._entry.write(data)
+
+    def close(self) -> None:
+        # Flushes the compressor tail, the data descriptor and the central directory
+        with self._lock:
+            try:
+                self._entry.close()
+            finally:
+                self._zf.close()
 
 
 async def create_ndjson_zip(
-    lines_iterator: AsyncGenerator[str, None],
-    archive_name: str,
+    lines_iterator: AsyncGenerator[bytes, None],
     ndjson_filename: str,
+    compression: int = zipfile.ZIP_DEFLATED,
+    compresslevel: Optional[int] = None,
 ) -> str:
     """
-    Consume lines from the async iterator, write them as newline-delimited JSON
-    into a temporary .ndjson file, pack it into a ZIP, and return the path to
-    the temporary ZIP file.
+    Consume raw (bytes) lines from the async iterator and stream them as
+    newline-delimited JSON straight into a single ZIP entry; return the path to the temporary
+    ZIP file (no intermediate .ndjson file is written).
+
+    Pass ``compression=zipfile.ZIP_STORED`` to skip re-compressing the payload
+    when archive size does not matter (e.g. the archive is just a container).
     """
-    # Temporary directory for the .ndjson file
-    with tempfile.TemporaryDirectory() as tmpdir:
-        ndjson_path = os.path.join(tmpdir, ndjson_filename)
-        # Write all lines, one per line
-        with open(ndjson_path, "w", encoding="utf-8") as f:
+    persistent_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
+    persistent_zip.close()
+    try:
+        writer = _ZipEntryWriter(
+            persistent_zip.name, ndjson_filename, compression, compresslevel
+        )
+        try:
+            buf = []
+            buf_size = 0
             async for line in lines_iterator:
-                f.write(line + "\n")
-
-        # Create ZIP containing only that file
-        zip_path = os.path.join(tmpdir, archive_name)
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            zf.write(ndjson_path, arcname=ndjson_filename)
-
-        # Copy the ZIP to a persistent temporary file (outlives the context)
-        persistent_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        with open(zip_path, "rb") as src, open(persistent_zip.name, "wb") as dst:
-            dst.write(src.read())
+                buf.append(line)
+                buf.append(b"\n")
+                buf_size += len(line) + 1
+                if buf_size >= WRITE_BUFFER_SIZE:
+                    await asyncio.to_thread(writer.write, b"".join(buf))
+                    buf.clear()
+                    buf_size = 0
+            await asyncio.to_thread(writer.write, b"".join(buf))
+        finally:
+            await asyncio.to_thread(writer.close)
+    except BaseException:
+        os.remove(persistent_zip.name)
+        raise
+    finally:
+        # Close the generator right away so its open files/temp zips are released
+        # deterministically instead of waiting for the async-gen finalizer
+        await lines_iterator.aclose()
 
     return persistent_zip.name
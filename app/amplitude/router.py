@@ -1,4 +1,6 @@
+import asyncio
 import os
+import zipfile
 
 from datetime import datetime
 from fastapi import APIRouter, Query, HTTPException, BackgroundTasks, Depends
@@ -8,17 +10,24 @@ from fastapi.responses import FileResponse
 from app.auth.deps import require_read
 from app.amplitude.client import AmplitudeClient
 from app.amplitude.export_utils import create_ndjson_zip
+from app.config.settings import settings
 from app.config.logger import get_logger
 
 logger = get_logger(__name__)
 router = APIRouter()
 
+# Ограничение числа одновременных экспортов в рамках процесса (защита от OOM)
+_export_sem = asyncio.Semaphore(settings.amplitude.max_concurrent_exports)
+
 
 @router.get("/export", response_class=FileResponse)
 async def amplitude_export(
     start: str = Query(..., description="Start date (YYYYMMDD)", example="20240201"),
     end: str = Query(..., description="End date (YYYYMMDD)", example="20240207"),
     source: Literal["web", "mobile"] = Query("web"),
+    compress: bool = Query(
+        True, description="Compress the archive (False returns an uncompressed ZIP)"
+    ),
     background_tasks: BackgroundTasks = None,
     user=Depends(require_read),
 ):
@@ -34,7 +43,14 @@ async def amplitude_export(
     archive_name = f"amplitude_export_{start}_{end}.zip"
     ndjson_name = f"amplitude_export_{start}_{end}.ndjson"
 
-    zip_path = await create_ndjson_zip(lines_iterator, archive_name, ndjson_name)
+    if _export_sem.locked():
+        logger.info("Amplitude export %s-%s is waiting for a free slot", start, end)
+    async with _export_sem:
+        zip_path = await create_ndjson_zip(
+            lines_iterator,
+            ndjson_name,
+            compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+        )
 
     if background_tasks:
         background_tasks.add_task(os.remove, zip_path)
@@ -1,12 +1,24 @@
-import httpx
 import asyncio
-from typing import Optional
+import os
+import random
+import tempfile
+from typing import AsyncGenerator, Optional, Tuple
 
 from app.config.settings import settings
 from app.config.logger import get_logger
+from app.http_client import get_http_client
 
 logger = get_logger(__name__)
 
+# Экспоненциальный backoff при опросе готовности экспорта
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_INTERVAL = 30
+
+# Размер чанка при потоковой записи ответа в файл
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+REQUEST_TIMEOUT = 60.0
+
 
 class AppMetricaClient:
     def __init__(self):
@@ -15,6 +27,56 @@ class AppMetricaClient:
         self.poll_interval = settings.appmetrica.poll_interval_seconds
         self.poll_timeout = settings.appmetrica.poll_timeout_seconds
 
+    def _prepare_request(
+        self,
+        application_id: Optional[str],
+        skip_unavailable_shards: bool,
+        date_since: Optional[str],
+        date_until: Optional[str],
+        date_dimension: str,
+        use_utf8_bom: bool,
+        fields: Optional[str],
+        export_format: str,
+        api_key: Optional[str],
+    ) -> Tuple[str, dict, dict]:
+        """Собрать URL, заголовки и параметры запроса экспорта."""
+        app_id = application_id or self.application_id
+        if not app_id:
+            raise RuntimeError("application_id is required")
+
+        params = {
+            "application_id": app_id,
+            "skip_unavailable_shards": str(skip_unavailable_shards).lower(),
+            "date_since": date_since,
+            "date_until": date_until,
+            "date_dimension": date_dimension,
+            "use_utf8_bom": str(use_utf8_bom).lower(),
+            "fields": fields,
+        }
+        params = {k: v for k, v in params.items() if v is not None}
+
+        # URL зависит от формата
+        url = f"{self.base_url.rstrip('/')}/logs/v1/export/events.{export_format}"
+        headers = {"Authorization": f"OAuth {api_key}"} if api_key else {}
+        return url, headers, params
+
+    @staticmethod
+    async def _poll_backoff(
+        poll_timeout: int, poll_interval: int
+    ) -> AsyncGenerator[None, None]:
+        """
+        Ждёт очередной интервал опроса (экспоненциальный backoff с джиттером)
+        и отдаёт управление, пока не истёк poll_timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + poll_timeout
+        delay = poll_interval
+        while loop.time() < deadline:
+            # Джиттер, чтобы параллельные опросы не шли синхронно
+            await asyncio.sleep(delay + random.random() * 0.2 * delay)
+            yield
+            delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+
     async def fetch_export(
         self,
         application_id: Optional[str] = None,
@@ -28,66 +90,151 @@ class AppMetricaClient:
         poll_timeout: Optional[int] = None,
         poll_interval: Optional[int] = None,
         api_key: str = None,
+        as_bytes: bool = False,
     ) -> dict:
         """
         Запросить экспорт событий и дождаться готовности.
 
         :param export_format: 'csv' или 'json' (определяет URL и тип результата)
+        :param as_bytes: вернуть тело ответа как есть (bytes), без декодирования
         :return: словарь вида
             {"status": "ready", "result": данные}   # result: dict для json, str для csv
+                                                    # (bytes при as_bytes=True)
             или
             {"status": "pending", "detail": "..."}
         """
         poll_timeout = poll_timeout or self.poll_timeout
         poll_interval = poll_interval or self.poll_interval
 
-        app_id = application_id or self.application_id
-        if not app_id:
-            raise RuntimeError("application_id is required")
+        url, headers, params = self._prepare_request(
+            application_id,
+            skip_unavailable_shards,
+            date_since,
+            date_until,
+            date_dimension,
+            use_utf8_bom,
+            fields,
+            export_format,
+            api_key,
+        )
 
-        params = {
-            "application_id": app_id,
-            "skip_unavailable_shards": str(skip_unavailable_shards).lower(),
-            "date_since": date_since,
-            "date_until": date_until,
-            "date_dimension": date_dimension,
-            "use_utf8_bom": str(use_utf8_bom).lower(),
-            "fields": fields,
-        }
-        params = {k: v for k, v in params.items() if v is not None}
+        client = get_http_client()
+        resp = await client.get(
+            url, headers=headers, params=params, timeout=REQUEST_TIMEOUT
+        )
 
-        # URL зависит от формата
-        url = f"{self.base_url.rstrip('/')}/logs/v1/export/events.{export_format}"
-        headers = {"Authorization": f"OAuth {api_key}"} if api_key else {}
+        # Если задача поставлена в очередь — начинаем polling
+        if resp.status_code == 202:
+            async for _ in self._poll_backoff(poll_timeout, poll_interval):
+                r2 = await client.get(
+                    url, headers=headers, params=params, timeout=REQUEST_TIMEOUT
+                )
+                if r2.status_code == 200:
+                    return {
+                        "status": "ready",
+                        "result": self._read_result(r2, export_format, as_bytes),
+                    }
+            # Тайм-аут
+            return {
+                "status": "pending",
+                "detail": "Timeout while waiting for export",
+            }
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.get(url, headers=headers, params=params)
+        # Готовый ответ сразу
+        elif resp.status_code == 200:
+            return {
+                "status": "ready",
+                "result": self._read_result(resp, export_format, as_bytes),
+            }
+        else:
+            resp.raise_for_status()
 
-            # Если задача поставлена в очередь — начинаем polling
-            if resp.status_code == 202:
-                start = asyncio.get_event_loop().time()
-                while asyncio.get_event_loop().time() - start < poll_timeout:
-                    await asyncio.sleep(poll_interval)
-                    r2 = await client.get(url, headers=headers, params=params)
-                    if r2.status_code == 200:
-                        if export_format == "json":
-                            return {"status": "ready", "result": r2.json()}
-                        else:
-                            return {"status": "ready", "result": r2.text}
+    @staticmethod
+    def _read_result(resp, export_format: str, as_bytes: bool):
+        if as_bytes:
+            # Сырые байты тела: без декодирования в str / разбора JSON
+            return resp.content
+        if export_format == "json":
+            return resp.json()
+        return resp.text
+
+    async def fetch_export_to_file(
+        self,
+        application_id: Optional[str] = None,
+        skip_unavailable_shards: bool = False,
+        date_since: Optional[str] = None,
+        date_until: Optional[str] = None,
+        date_dimension: str = "default",
+        use_utf8_bom: bool = True,
+        fields: Optional[str] = None,
+        export_format: str = "csv",
+        poll_timeout: Optional[int] = None,
+        poll_interval: Optional[int] = None,
+        api_key: str = None,
+    ) -> dict:
+        """
+        То же, что fetch_export, но готовый ответ не буферизуется в памяти,
+        а потоково записывается во временный файл.
+
+        :return: словарь вида
+            {"status": "ready", "path": путь к файлу}   # файл удаляет вызывающий
+            или
+            {"status": "pending", "detail": "..."}
+        """
+        poll_timeout = poll_timeout or self.poll_timeout
+        poll_interval = poll_interval or self.poll_interval
+
+        url, headers, params = self._prepare_request(
+            application_id,
+            skip_unavailable_shards,
+            date_since,
+            date_until,
+            date_dimension,
+            use_utf8_bom,
+            fields,
+            export_format,
+            api_key,
+        )
+
+        path = await self._download_to_file(url, headers, params, export_format)
+        if path is None:
+            async for _ in self._poll_backoff(poll_timeout, poll_interval):
+                path = await self._download_to_file(url, headers, params, export_format)
+                if path is not None:
+                    break
+            else:
                 # Тайм-аут
                 return {
                     "status": "pending",
                     "detail": "Timeout while waiting for export",
                 }
+        return {"status": "ready", "path": path}
 
-            # Готовый ответ сразу
-            elif resp.status_code == 200:
-                if export_format == "json":
-                    return {"status": "ready", "result": resp.json()}
-                else:
-                    return {"status": "ready", "result": resp.text}
-            else:
-                resp.raise_for_status()
+    async def _download_to_file(
+        self, url: str, headers: dict, params: dict, suffix: str
+    ) -> Optional[str]:
+        """
+        Один запрос экспорта: при 200 тело потоково пишется во временный файл
+        и возвращается его путь, при 202 (экспорт ещё готовится) — None.
+        """
+        client = get_http_client()
+        async with client.stream(
+            "GET", url, headers=headers, params=params, timeout=REQUEST_TIMEOUT
+        ) as resp:
+            if resp.status_code == 202:
+                return None
+            resp.raise_for_status()
+
+            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=f".{suffix}")
+            try:
+                async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+            tmp.close()
+            return tmp.name
 
 
 client = AppMetricaClient()
@@ -1,17 +1,45 @@
-from fastapi import Request, APIRouter, HTTPException, Query, Depends
-from fastapi.responses import StreamingResponse
+"""
+Роутер экспорта событий AppMetrica.
+
+Инвариант: обработчики не блокируют event loop.
+- HTTP-запросы к AppMetrica идут только через общий httpx.AsyncClient
+  (app.http_client.get_http_client); синхронные httpx.Client / requests
+  здесь и в .client не используются.
+- Ожидание готовности экспорта — только await asyncio.sleep
+  (AppMetricaClient._poll_backoff), никогда time.sleep.
+- CPU-ёмкая работа (CRC, DEFLATE, упаковка в ZIP) выполняется в потоках
+  через asyncio.to_thread.
+"""
+
+from fastapi import Request, APIRouter, HTTPException, Query, Depends, BackgroundTasks
+from fastapi.responses import FileResponse, StreamingResponse
 from app.auth.deps import require_read
-from typing import Optional
-import json
-import io
-import zipfile
+from typing import Final, Optional
+import asyncio
+import os
+import re
 
 from .client import client
 from app.config.logger import get_logger
+from app.zip_stream import stream_zip, zip_file
 
 logger = get_logger(__name__)
 router = APIRouter()
 
+# Поля экспорта по умолчанию (если fields не передан)
+_DEFAULT_FIELDS: Final[str] = (
+    "app_build_number,profile_id,os_name,os_version,device_manufacturer,"
+    "device_model,device_type,device_locale,device_ipv6,app_version_name,"
+    "event_name,event_json,connection_type,operator_name,country_iso_code,city,"
+    "appmetrica_device_id,installation_id,session_id,event_datetime"
+)
+
+# BOM в начале ответа AppMetrica (use_utf8_bom=True)
+_UTF8_BOM: Final[bytes] = b"\xef\xbb\xbf"
+
+# Формат date_since / date_until: YYYY-MM-DD HH:MM:SS
+_DT_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}", re.ASCII)
+
 
 @router.get("/ping")
 async def ping(user=Depends(require_read)):
@@ -40,6 +68,10 @@ async def export_events(
         regex="^(csv|json)$",
         description="Export format: 'csv' (default) or 'json'",
     ),
+    compress: bool = Query(
+        False, description="Compress the archive (slower, but smaller)"
+    ),
+    background_tasks: BackgroundTasks = None,
     user=Depends(require_read),
 ):
     """
@@ -47,6 +79,7 @@ async def export_events(
 
     - **date_since**, **date_until** — обязательны для ограничения периода.
     - **export_format** = `csv` (по умолчанию) или `json`.
+    - **compress** — сжимать ли архив (по умолчанию ZIP без сжатия).
     - При готовности данных возвращается ZIP‑архив с файлом
       `appmetrica_resp.csv` или `appmetrica_resp.json`.
     - Если экспорт ещё не готов — возвращается JSON со статусом `pending`.
@@ -82,19 +115,21 @@ async def export_events(
     ```
     Поле `event_json` может содержать произвольный JSON‑объект.
     """
+    # Проверяем даты до дорогого запроса и polling в AppMetrica
+    for name, value in (("date_since", date_since), ("date_until", date_until)):
+        if value and not _DT_RE.fullmatch(value):
+            raise HTTPException(
+                status_code=422,
+                detail=f"Bad {name}: expected format YYYY-MM-DD HH:MM:SS",
+            )
+
     auth_header = request.headers.get("Authorization")
     raw_token = auth_header.removeprefix("Bearer ").strip()
 
     try:
-        default_fields = (
-            "app_build_number,profile_id,os_name,os_version,device_manufacturer,device_model,device_type,"
-            "device_locale,device_ipv6,app_version_name,event_name,event_json,connection_type,operator_name,"
-            "country_iso_code,city,appmetrica_device_id,installation_id,session_id,event_datetime"
-        )
-        fields_param = fields or default_fields
+        fields_param = fields or _DEFAULT_FIELDS
 
-        # Запрос к AppMetrica
-        result = await client.fetch_export(
+        request_kwargs = dict(
             application_id=application_id,
             skip_unavailable_shards=skip_unavailable_shards,
             date_since=date_since,
@@ -106,34 +141,48 @@ async def export_events(
             api_key=raw_token,
         )
 
-        # Если экспорт ещё не готов (pending) — возвращаем JSON с описанием
-        if result.get("status") != "ready":
-            return result
-
-        # Данные готовы — упаковываем в ZIP
-        data = result["result"]
-
-        # Формируем имя файла внутри архива
-        if export_format == "json":
-            content = json.dumps(data, ensure_ascii=False).encode("utf-8")
-            filename = "appmetrica_resp.json"
-        else:  # csv
-            content = data.encode("utf-8")
-            filename = "appmetrica_resp.csv"
-
-        # Создаём ZIP в памяти
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            zip_file.writestr(filename, content)
-        zip_buffer.seek(0)
-
         # Имя скачиваемого архива
         zip_name = (
             f"appmetrica_export_{date_since or 'since'}_{date_until or 'until'}.zip"
         )
 
+        if export_format == "csv":
+            # CSV не буферизуем в памяти: ответ потоково пишется во временный файл
+            result = await client.fetch_export_to_file(**request_kwargs)
+            if result.get("status") != "ready":
+                return result
+
+            csv_path = result["path"]
+            try:
+                zip_path = await asyncio.to_thread(
+                    zip_file, csv_path, "appmetrica_resp.csv", compress
+                )
+            finally:
+                os.remove(csv_path)
+
+            if background_tasks:
+                background_tasks.add_task(os.remove, zip_path)
+            return FileResponse(
+                zip_path, filename=zip_name, media_type="application/zip"
+            )
+
+        # Запрос к AppMetrica: тело берём как есть, без разбора и повторной
+        # сериализации JSON
+        result = await client.fetch_export(**request_kwargs, as_bytes=True)
+
+        # Если экспорт ещё не готов (pending) — возвращаем JSON с описанием
+        if result.get("status") != "ready":
+            return result
+
+        # Данные готовы — упаковываем в ZIP. Тело не разбирается как JSON
+        # (и не валидируется); снимаем только UTF-8 BOM (use_utf8_bom=True),
+        # который раньше убирал разбор с повторной сериализацией
+        content = result["result"].removeprefix(_UTF8_BOM)
+        filename = "appmetrica_resp.json"
+
+        # ZIP формируется на лету и сразу отдаётся клиенту
         return StreamingResponse(
-            zip_buffer,
+            stream_zip(filename, content, compress),
             media_type="application/zip",
             headers={"Content-Disposition": f"attachment; filename={zip_name}"},
         )
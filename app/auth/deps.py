@@ -1,46 +1,45 @@
+import asyncio
+import hashlib
+import time
 import httpx
 import jwt
 
+from typing import Dict, Optional, Tuple
+
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer
 
 from .schemas import User
 from app.config.settings import settings
 from app.config.logger import get_logger
+from app.http_client import get_http_client
 
 logger = get_logger(__name__)
 oauth2_scheme = HTTPBearer()
 
+# Кэш проверенных токенов: повторные запросы не ходят в Яндекс и не декодируют JWT
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_MAXSIZE = 10_000
 
-async def get_current_user(
-    request: Request, credentials=Depends(oauth2_scheme)
-) -> User:
-    oauth_token = credentials.credentials
+# blake2b(токен) -> (пользователь, момент истечения по time.monotonic())
+_auth_cache: Dict[bytes, Tuple[User, float]] = {}
+_auth_locks: Dict[bytes, asyncio.Lock] = {}
+
+# Параметры проверки JWT фиксированы — готовим их один раз при импорте
+_JWT_KEY = settings.yandex.client_secret.encode()
+_JWT_ALGORITHMS = ["HS256"]
+_JWT_OPTIONS = {"require": ["exp", "iat"], "verify_exp": True}
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://login.yandex.ru/info",
-            params={
-                "format": "jwt",
-            },
-            headers={"Authorization": f"OAuth {oauth_token}"},
-            timeout=10,
-        )
 
-        if resp.status_code != 200:
-            raise HTTPException(status_code=401, detail=f"Yandex error: {resp.text}")
+def _token_key(oauth_token: str) -> bytes:
+    return hashlib.blake2b(oauth_token.encode(), digest_size=16).digest()
 
-        jwt_token = resp.text.strip()
 
+def _decode_jwt(token: str) -> dict:
+    """Проверить подпись HS256 и claims JWT (PyJWT), вернуть payload."""
     try:
-        payload = jwt.decode(
-            jwt_token,
-            settings.yandex.client_secret,
-            algorithms=["HS256"],
-            options={
-                "require": ["exp", "iat"],
-                "verify_exp": True,
-            },
+        return jwt.decode(
+            token, _JWT_KEY, algorithms=_JWT_ALGORITHMS, options=_JWT_OPTIONS
         )
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="JWT expired")
@@ -49,23 +48,92 @@ async def get_current_user(
     except jwt.InvalidTokenError as e:
         raise HTTPException(status_code=401, detail=f"Invalid JWT: {str(e)}")
 
+
+def _cache_get(key: bytes) -> Optional[User]:
+    entry = _auth_cache.get(key)
+    if entry is None:
+        return None
+    user, expires_at = entry
+    if expires_at <= time.monotonic():
+        _auth_cache.pop(key, None)
+        return None
+    return user
+
+
+def _cache_put(key: bytes, user: User, exp: float) -> None:
+    """Сохранить пользователя на AUTH_CACHE_TTL, но не дольше срока жизни JWT."""
+    ttl = min(AUTH_CACHE_TTL, exp - time.time())
+    if ttl <= 0:
+        return
+    if len(_auth_cache) >= AUTH_CACHE_MAXSIZE:
+        # Вытесняем самую старую запись (dict сохраняет порядок вставки)
+        _auth_cache.pop(next(iter(_auth_cache)))
+    _auth_cache[key] = (user, time.monotonic() + ttl)
+
+
+async def _authenticate(
+    oauth_token: str, client: httpx.AsyncClient
+) -> Tuple[User, float]:
+    """Проверить OAuth-токен через Яндекс, вернуть пользователя и exp JWT."""
+    resp = await client.get(
+        "https://login.yandex.ru/info",
+        params={
+            "format": "jwt",
+        },
+        headers={"Authorization": f"OAuth {oauth_token}"},
+        timeout=10,
+    )
+
+    if resp.status_code != 200:
+        raise HTTPException(status_code=401, detail=f"Yandex error: {resp.text}")
+
+    jwt_token = resp.text.strip()
+
+    payload = _decode_jwt(jwt_token)
+
     login = payload.get("login")
     if not login:
         raise HTTPException(status_code=401, detail="No login in token")
 
-    if login in settings.get_write_access_list():
-        return User(login=login, access="write")
-    if login in settings.get_read_access_list():
-        return User(login=login, access="read")
+    if login in settings.write_access:
+        return User(login=login, access="write"), payload["exp"]
+    if login in settings.read_access:
+        return User(login=login, access="read"), payload["exp"]
 
     raise HTTPException(status_code=403, detail="Access denied")
 
 
-def require_write(user: User = Depends(get_current_user)):
+async def get_current_user(
+    request: Request,
+    credentials=Depends(oauth2_scheme),
+) -> User:
+    oauth_token = credentials.credentials
+    key = _token_key(oauth_token)
+
+    user = _cache_get(key)
+    if user is not None:
+        return user
+
+    # Один запрос в Яндекс на токен, даже если параллельно пришло много запросов
+    lock = _auth_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            user = _cache_get(key)
+            if user is None:
+                user, exp = await _authenticate(oauth_token, get_http_client())
+                _cache_put(key, user, exp)
+    finally:
+        if not lock.locked():
+            _auth_locks.pop(key, None)
+    return user
+
+
+# async def: синхронные зависимости FastAPI выполняет в threadpool на каждый запрос
+async def require_write(user: User = Depends(get_current_user)):
     if user.access != "write":
         raise HTTPException(status_code=403, detail="Write access required")
     return user
 
 
-def require_read(user: User = Depends(get_current_user)):
+async def require_read(user: User = Depends(get_current_user)):
     return user
@@ -1,4 +1,4 @@
-from .settings import Settings, settings
+from .settings import Settings, get_settings, settings
 from .logger import configure_logging, get_logger
 
-__all__ = ["Settings", "settings", "configure_logging", "get_logger"]
+__all__ = ["Settings", "get_settings", "settings", "configure_logging", "get_logger"]
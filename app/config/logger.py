@@ -1,6 +1,9 @@
 import logging
 from typing import Optional
 
+# Handler of the root logger, created once and reused by configure_logging
+_console_handler: Optional[logging.Handler] = None
+
 
 def configure_logging(level: Optional[str] = None) -> None:
     """Configure logging for the application.
@@ -8,7 +11,12 @@ def configure_logging(level: Optional[str] = None) -> None:
     Args:
         level: Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL).
                Defaults to INFO if not provided.
+
+    Safe to call repeatedly: the console handler is attached to the root logger
+    only once, later calls just update its level.
     """
+    global _console_handler
+
     log_level = level or "INFO"
     numeric_level = getattr(logging, log_level.upper(), logging.INFO)
 
@@ -17,16 +25,17 @@ def configure_logging(level: Optional[str] = None) -> None:
     root_logger.setLevel(numeric_level)
 
     # Console handler with formatting
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(numeric_level)
-
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-    console_handler.setFormatter(formatter)
-
-    root_logger.addHandler(console_handler)
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler()
+        formatter = logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+        _console_handler.setFormatter(formatter)
+    _console_handler.setLevel(numeric_level)
+
+    if _console_handler not in root_logger.handlers:
+        root_logger.addHandler(_console_handler)
 
     # Log initial configuration
     logger = logging.getLogger(__name__)
@@ -1,6 +1,7 @@
-from typing import Optional
+from functools import lru_cache
+from typing import Annotated, Optional
 
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 from pydantic import BaseModel, Field, field_validator
 
 
@@ -17,6 +18,16 @@ class DBSettings(BaseModel):
     safety_factor: float
     minconn: int = 1
     maxconn: int = 10
+    # Отдельный (меньший) пул для долгих чтений, чтобы они не вытесняли запись
+    read_maxconn: int = 4
+    # Соединение, простоявшее в пуле дольше, проверяется SELECT 1 перед выдачей
+    conn_probe_idle_seconds: int = 30
+    async_insert_max_rows: int = 1000
+    async_insert_wait_time_ms: int = 200
+    # Потоковый SELECT (/db/events-part/stream): лимит на каждый FETCH и на
+    # простой между FETCH, пока клиент не забрал ответ
+    stream_statement_timeout_ms: int = 60_000
+    stream_idle_timeout_ms: int = 60_000
 
 
 class AppMetricaSettings(BaseModel):
@@ -99,10 +110,15 @@ class AmplitudeSettings(BaseModel):
     web_client_id: str
     mobile_secret_key: str
     mobile_client_id: str
+    max_parallel_days: int = 6
+    max_concurrent_exports: int = 2
 
 
 class ETLSettings(BaseModel):
     batch_size: int
+    # Процессов для трансформации Amplitude-файлов (0 — в текущем процессе)
+    transform_workers: int = 0
+    transform_chunk_size: int = 1000
 
 
 class Settings(BaseSettings):
@@ -131,33 +147,22 @@ class Settings(BaseSettings):
     amplitude: AmplitudeSettings
     yandex: YandexOAuthSettings
     etl: ETLSettings
-    read_access: str = Field(validation_alias="AUTH_READ_ACCESS")
-    write_access: str = Field(validation_alias="AUTH_WRITE_ACCESS")
+    # NoDecode: значение из env — строка через запятую, а не JSON
+    read_access: Annotated[frozenset[str], NoDecode] = Field(
+        validation_alias="AUTH_READ_ACCESS"
+    )
+    write_access: Annotated[frozenset[str], NoDecode] = Field(
+        validation_alias="AUTH_WRITE_ACCESS"
+    )
     params_to_remove: str = Field(validation_alias="ETL_QUERY_PARAMS_TO_REMOVE")
 
-    @field_validator(
-        "read_access",
-        "write_access",
-        "parrams_to_remove",
-        mode="after",
-        check_fields=False,
-    )
+    @field_validator("read_access", "write_access", mode="before")
     @classmethod
     def parse_access_lists(cls, v):
-        """Ensure read_access and write_access are strings (will parse on access)."""
-        return v if isinstance(v, str) else ""
-
-    def get_read_access_list(self) -> list[str]:
-        """Get read_access as list of strings."""
-        if not self.read_access:
-            return []
-        return [x.strip() for x in self.read_access.split(",") if x.strip()]
-
-    def get_write_access_list(self) -> list[str]:
-        """Get write_access as list of strings."""
-        if not self.write_access:
-            return []
-        return [x.strip() for x in self.write_access.split(",") if x.strip()]
+        """Parse comma-separated logins once into a frozenset."""
+        if isinstance(v, str):
+            return frozenset(x.strip() for x in v.split(",") if x.strip())
+        return v
 
     def get_query_params_to_remove(self) -> list[str]:
         if not self.params_to_remove:
@@ -165,4 +170,10 @@ class Settings(BaseSettings):
         return [x.strip() for x in self.params_to_remove.split(",") if x.strip()]
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide Settings instance (.env is read only once)."""
+    return Settings()
+
+
+settings = get_settings()
@@ -1,9 +1,22 @@
-from typing import List, Dict, Any, Optional, Set, Tuple
+import io
+import json
+import operator
+import queue
+import threading
+import time
+import types
+import typing
+from datetime import date, datetime
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional, Sequence, Set, Tuple
 from uuid import UUID
 
+try:
+    import orjson
+except ImportError:  # orjson не установлен — используем stdlib json
+    orjson = None
+
 import psycopg2
-from psycopg2 import pool, extras
-from psycopg2.sql import SQL, Identifier, Placeholder
+from psycopg2 import extensions, pool, extras
 from psycopg2.extras import register_uuid
 
 from app.config.settings import settings
@@ -14,6 +27,280 @@ logger = get_logger(__name__)
 register_uuid()
 
 
+def _json_dumps(value: Any) -> str:
+    """dict -> JSON-текст для json/jsonb колонок (orjson, если установлен)."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, ensure_ascii=False)
+
+
+# dict-значения (TechnicalData, tmp_*_properties) уходят в json/jsonb-колонки:
+# без адаптера psycopg2 не умеет передавать dict параметром запроса
+extensions.register_adapter(dict, lambda value: extras.Json(value, dumps=_json_dumps))
+
+# Сколько однотипных statement'ов отправлять за один round trip (execute_batch)
+STATEMENTS_PER_ROUNDTRIP = 100
+
+# Начиная с этого числа uuid update_migrated_batch не шлёт один огромный массив
+# в ANY(%s), а обновляет строки пачками statement'ов по MIGRATED_PAGE_SIZE
+MIGRATED_ANY_MAX_UUIDS = 50_000
+MIGRATED_PAGE_SIZE = 1000
+
+# Полный скан ehr_id: размер порции серверного курсора и лимит времени запроса
+EHR_SCAN_ITERSIZE = 10_000
+EHR_SCAN_STATEMENT_TIMEOUT = "10min"
+
+# Размер порции серверного курсора при потоковой выдаче SELECT (iter_select)
+SELECT_STREAM_ITERSIZE = 10_000
+
+_FIRST_COLUMN = operator.itemgetter(0)
+
+# Ветки get_latest_changeable_for_ehrs, склеиваемые через UNION ALL
+_LATEST_CHANGEABLE_BY_EHR_SQL = """(
+    SELECT DISTINCT ON (ehr_id) *
+    FROM changeable_user_properties
+    WHERE ehr_id = ANY(%s::bigint[])
+    ORDER BY ehr_id, event_time DESC
+)"""
+_LATEST_CHANGEABLE_NULL_EHR_SQL = """(
+    SELECT *
+    FROM changeable_user_properties
+    WHERE ehr_id IS NULL
+    ORDER BY event_time DESC
+    LIMIT 1
+)"""
+
+# Экранирование спецсимволов для текстового формата COPY
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _quote_ident(name: str) -> str:
+    """Экранировать идентификатор так же, как psycopg2.sql.Identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Типы полей модели, значения которых psycopg2 адаптирует как элементы массива
+_SCALAR_TYPES = (bool, int, float, str, datetime, date, UUID)
+
+
+def _strip_annotated(annotation):
+    """Annotated[X, ...] -> X (валидаторы не меняют тип значения в БД)."""
+    if typing.get_origin(annotation) is typing.Annotated:
+        return typing.get_args(annotation)[0]
+    return annotation
+
+
+def _is_scalar_annotation(annotation) -> bool:
+    """Optional[X] / X (в т.ч. Annotated[X, ...]), где X — скалярный тип."""
+    annotation = _strip_annotated(annotation)
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) != 1:
+            return False
+        annotation = _strip_annotated(args[0])
+    return annotation in _SCALAR_TYPES
+
+
+def _row_getter(columns) -> Any:
+    """row -> кортеж значений columns одним вызовом на C (operator.itemgetter)."""
+    if len(columns) == 1:
+        # itemgetter с одним ключом вернул бы скаляр, а не кортеж
+        (col,) = columns
+        return lambda row: (row[col],)
+    return operator.itemgetter(*columns)
+
+
+def _copy_array_literal(values: list) -> str:
+    """Список -> литерал массива PostgreSQL: {"a","b",NULL}."""
+    items = []
+    for v in values:
+        if v is None:
+            items.append("NULL")
+        elif isinstance(v, (list, tuple)):
+            items.append(_copy_array_literal(v))
+        else:
+            text = _copy_scalar(v).replace("\\", "\\\\").replace('"', '\\"')
+            items.append(f'"{text}"')
+    return "{" + ",".join(items) + "}"
+
+
+def _copy_scalar(value: Any) -> str:
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return _json_dumps(value)
+    if isinstance(value, (list, tuple)):
+        return _copy_array_literal(value)
+    return str(value)
+
+
+def _copy_text_row(values: tuple) -> str:
+    """Строка для COPY ... FROM STDIN (текстовый формат): табы, \\N для NULL."""
+    return (
+        "\t".join(
+            "\\N" if v is None else _copy_scalar(v).translate(_COPY_ESCAPES)
+            for v in values
+        )
+        + "\n"
+    )
+
+
+class AsyncWriteBuffer:
+    """
+    Копит мелкие записи в очереди и пишет их пачками из фонового потока:
+    как только набралось max_rows элементов или прошло wait_time_ms с первого.
+    Очередь ограничена max_rows, поэтому при отставании БД продюсеры ждут.
+    """
+
+    def __init__(self, write_fn, max_rows: int, wait_time_ms: int, name: str):
+        self._write_fn = write_fn
+        self._max_rows = max_rows
+        self._wait = wait_time_ms / 1000
+        self._queue: queue.Queue = queue.Queue(maxsize=max_rows)
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item) -> None:
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            try:
+                batch = [self._queue.get(timeout=self._wait)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self._wait
+            while len(batch) < self._max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        with self._write_lock:
+            try:
+                self._write_fn(batch)
+            except Exception:
+                logger.exception(
+                    f"{self._thread.name}: failed to write {len(batch)} buffered rows"
+                )
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Синхронно записать всё, что сейчас лежит в очереди, и дождаться пачки,
+        которую фоновый поток уже забрал из очереди, но ещё пишет.
+        """
+        while True:
+            batch = []
+            while len(batch) < self._max_rows:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write(batch)
+        self._queue.join()
+
+    def close(self) -> None:
+        """Остановить фоновый поток и дописать остаток."""
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+
+class Seek(NamedTuple):
+    """
+    Условие keyset-пагинации: строки после курсора в порядке
+    ORDER BY columns (все ASC или все DESC). columns — (sort_by, pk) или (pk,),
+    values — значения этих колонок у последней строки предыдущей страницы.
+
+    Если колонка сортировки nullable, values[0] может быть None (у последней
+    строки NULL). NULL идут последними при ASC и первыми при DESC, как
+    по умолчанию в PostgreSQL; сравнение строк (a, b) > (x, y) с NULL даёт
+    NULL, поэтому такие строки учитываются отдельным IS NULL.
+    """
+
+    columns: Tuple[str, ...]
+    values: tuple
+    desc: bool = False
+    nullable: bool = False
+
+
+def _seek_sql(seek: Seek, ident) -> str:
+    """SQL-условие для Seek; ident экранирует имя колонки."""
+    op = "<" if seek.desc else ">"
+    cols = [ident(col) for col in seek.columns]
+    if len(cols) == 1:
+        return f"{cols[0]} {op} %s"
+    row = f"({', '.join(cols)}) {op} ({', '.join(['%s'] * len(cols))})"
+    if not seek.nullable:
+        return row
+    sort_col, pk_cols = cols[0], cols[1:]
+    if seek.values[0] is None:
+        # Курсор внутри группы NULL: дальше — остаток этой группы по pk,
+        # а при DESC (NULLS FIRST) — ещё и все непустые значения
+        pk_row = f"({', '.join(pk_cols)}) {op} ({', '.join(['%s'] * len(pk_cols))})"
+        if seek.desc:
+            return f"({sort_col} IS NOT NULL OR {pk_row})"
+        return f"({sort_col} IS NULL AND {pk_row})"
+    # Непустой курсор: при ASC (NULLS LAST) после него идут и все NULL
+    return row if seek.desc else f"({row} OR {sort_col} IS NULL)"
+
+
+class SelectStream:
+    """
+    Итератор строк потокового SELECT (DBRepository.iter_select).
+
+    close() идемпотентен: закрывает курсор, завершает транзакцию и возвращает
+    соединение в пул чтения. Вызывается сам по исчерпании или ошибке, а при
+    досрочной остановке — вызывающим (в т.ч. для ещё не начатого потока).
+    """
+
+    def __init__(self, repo: "DBRepository", conn, cursor):
+        self._repo = repo
+        self._conn = conn
+        self._cursor = cursor
+        self._rows = iter(cursor)
+
+    def __iter__(self) -> "SelectStream":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._conn is None:
+            raise StopIteration
+        try:
+            return next(self._rows)
+        except StopIteration:
+            self.close()
+            raise
+        except BaseException:
+            self.close(failed=True)
+            raise
+
+    def close(self, failed: bool = False) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if not conn.closed:
+                self._cursor.close()
+        except psycopg2.Error:
+            failed = True
+        self._repo._end_stream(conn, failed)
+
+
 class DBRepository:
     """
     Единый репозиторий для работы с PostgreSQL.
@@ -42,19 +329,50 @@ class DBRepository:
     }
 
     def __init__(self):
-        self.pool = pool.ThreadedConnectionPool(
-            minconn=settings.db.minconn,
-            maxconn=settings.db.maxconn,
+        # Отдельные пулы для чтения и записи: долгие сканы не выбирают
+        # все соединения у коротких INSERT/UPDATE
+        self.write_pool = self._create_pool(settings.db.maxconn)
+        self.read_pool = self._create_pool(settings.db.read_maxconn)
+        self._pools = {"write": self.write_pool, "read": self.read_pool}
+        # Момент возврата соединения в пул (time.monotonic) — для проверки
+        # долго простаивавших соединений в _get_conn
+        self._returned_at: Dict[Any, float] = {}
+        # Счётчики выданных соединений (pool_stats)
+        self._in_use = {kind: 0 for kind in self._pools}
+        self._stats_lock = threading.Lock()
+        self._column_counts: Dict[str, int] = {}
+        self._max_rows: Dict[str, int] = {}
+        self._col_idents: Dict[str, Dict[str, str]] = {}
+        self._precompute_column_counts()
+        # Переиспользуемый обычный курсор на каждое соединение пула
+        # (курсор держит ссылку на соединение, поэтому закрытые убираем сами)
+        self._cursors: Dict[Any, Any] = {}
+        # Типы скалярных колонок по таблицам для INSERT ... FROM UNNEST
+        self._array_types: Dict[str, Dict[str, str]] = {}
+        # Готовые строки SQL по «форме» запроса (таблица, колонки, ON CONFLICT, ...)
+        self._sql_cache: Dict[tuple, str] = {}
+        # Буферы отложенной вставки (POST с X-Async-Insert), создаются по таблице
+        self._insert_buffers: Dict[str, AsyncWriteBuffer] = {}
+        self._insert_buffers_lock = threading.Lock()
+        logger.info(f"DBRepository initialized. Column counts: {self._column_counts}")
+
+    @staticmethod
+    def _create_pool(maxconn: int) -> pool.ThreadedConnectionPool:
+        return pool.ThreadedConnectionPool(
+            minconn=min(settings.db.minconn, maxconn),
+            maxconn=maxconn,
             dbname=settings.db.name,
             user=settings.db.user,
             password=settings.db.password,
             host=settings.db.host,
             port=settings.db.port,
-            cursor_factory=extras.RealDictCursor,
+            # TCP keepalive: «мёртвые» соединения (NAT, рестарт БД) обнаруживаются
+            # сами, а не на первом запросе после долгого простоя
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
         )
-        self._column_counts: Dict[str, int] = {}
-        self._precompute_column_counts()
-        logger.info(f"DBRepository initialized. Column counts: {self._column_counts}")
 
     def _get_model_class(self, table: str):
         """
@@ -80,67 +398,178 @@ class DBRepository:
             else:
                 model_class = model
             self._column_counts[table_name] = len(model_class.model_fields)
+            # Лимит строк на INSERT зависит только от настроек и числа колонок
+            self._max_rows[table_name] = self._compute_max_rows(
+                self._column_counts[table_name]
+            )
+            # Экранированные идентификаторы колонок — один раз на старте
+            self._col_idents[table_name] = {
+                col: _quote_ident(col) for col in model_class.model_fields
+            }
 
     def _max_rows_for_table(self, table_name: str) -> int:
         """Максимальное количество строк в одном INSERT с учётом протокола."""
-        if table_name not in self._column_counts:
+        max_rows = self._max_rows.get(table_name)
+        if max_rows is None:
             logger.warning(
                 f"Unknown table '{table_name}', using fallback column count = 20"
             )
-            col_count = 20
-        else:
-            col_count = self._column_counts[table_name]
+            max_rows = self._compute_max_rows(20)
+        return max_rows
 
+    @staticmethod
+    def _compute_max_rows(col_count: int) -> int:
         theoretical_max = settings.db.max_params_per_query // col_count
         safe_max = int(theoretical_max * settings.db.safety_factor)
-
-        configured_max = getattr(settings.db, "max_rows_per_insert", 10000)
-        if not hasattr(settings.db, "max_rows_per_insert"):
-            logger.warning(
-                "settings.db.max_rows_per_insert not set, using default 10000. "
-                "Consider adding this parameter to your DBSettings."
-            )
-
-        return min(safe_max, configured_max)
+        return min(safe_max, settings.db.max_rows_per_insert)
 
     # ---------- Управление соединениями ----------
-    def _get_conn(self):
-        """Получить соединение из пула с включённым autocommit."""
-        conn = self.pool.getconn()
-        conn.autocommit = True
+    def _get_conn(self, kind: str = "write"):
+        """
+        Получить живое соединение из пула kind ("read" / "write") с autocommit.
+        Пул отдаёт последнее возвращённое соединение (LIFO); закрытые и
+        оборванные соединения выбрасываются из пула вместо выдачи вызывающему.
+        Флаги closed / transaction_status меняются только после неудачной
+        операции, поэтому соединение, простоявшее дольше
+        conn_probe_idle_seconds, дополнительно проверяется запросом SELECT 1.
+        """
+        conn_pool = self._pools[kind]
+        while True:
+            conn = conn_pool.getconn()
+            idle_since = self._returned_at.pop(conn, None)
+            if not conn.closed and (
+                conn.info.transaction_status != extensions.TRANSACTION_STATUS_UNKNOWN
+            ):
+                conn.autocommit = True
+                if (
+                    idle_since is None
+                    or time.monotonic() - idle_since
+                    < settings.db.conn_probe_idle_seconds
+                    or self._probe(conn)
+                ):
+                    break
+            logger.warning("Discarding broken DB connection from pool")
+            conn_pool.putconn(conn, close=True)
+            self._cursors.pop(conn, None)
+        with self._stats_lock:
+            self._in_use[kind] += 1
         return conn
 
-    def _put_conn(self, conn):
-        """Вернуть соединение в пул."""
-        self.pool.putconn(conn)
+    @staticmethod
+    def _probe(conn) -> bool:
+        """Дешёвая проверка, что сервер ещё держит соединение."""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _put_conn(self, conn, kind: str = "write"):
+        """Вернуть соединение в пул kind (закрытое — выбросить)."""
+        if not conn.closed:
+            self._returned_at[conn] = time.monotonic()
+        self._pools[kind].putconn(conn, close=bool(conn.closed))
+        with self._stats_lock:
+            self._in_use[kind] -= 1
+        if conn.closed:
+            # Пул сам закрывает лишние простаивающие соединения
+            self._cursors.pop(conn, None)
+            self._returned_at.pop(conn, None)
 
-    def execute(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Выданные соединения по пулам (для /health/db). Считаются в
+        _get_conn / _put_conn, а не по приватным полям пула psycopg2.
+        """
+        with self._stats_lock:
+            return {
+                kind: {"in_use": self._in_use[kind], "max": conn_pool.maxconn}
+                for kind, conn_pool in self._pools.items()
+            }
+
+    def execute(
+        self,
+        query: str,
+        params: tuple = None,
+        dict_rows: bool = False,
+        read_only: bool = False,
+    ) -> List[Any]:
         """
         Выполнить запрос и вернуть результат.
-        При SELECT возвращает список словарей, при UPDATE/INSERT — пустой список.
+        При SELECT возвращает список кортежей (при dict_rows=True — словарей),
+        при UPDATE/INSERT — пустой список.
+        read_only=True — запрос выполняется на пуле чтения.
         """
-        conn = self._get_conn()
+        return self._execute(
+            query,
+            params,
+            extras.RealDictCursor if dict_rows else None,
+            "read" if read_only else "write",
+        )
+
+    def _cursor(self, conn):
+        """
+        Обычный курсор соединения: создаётся один раз и переиспользуется,
+        вместо открытия/закрытия курсора на каждый запрос. Результаты всегда
+        выбираются целиком (fetchall), так что следующий execute безопасен.
+        """
+        cur = self._cursors.get(conn)
+        if cur is None or cur.closed:
+            cur = self._cursors[conn] = conn.cursor()
+        return cur
+
+    def _execute(
+        self,
+        query: str,
+        params: tuple = None,
+        cursor_factory=None,
+        kind: str = "write",
+    ) -> list:
+        conn = self._get_conn(kind)
         try:
-            with conn.cursor() as cur:
-                cur.execute(query, params)
-                if cur.description:  # SELECT
-                    return cur.fetchall()
-                return []
+            if cursor_factory is None:
+                return self._fetch(self._cursor(conn), query, params)
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                return self._fetch(cur, query, params)
         finally:
-            self._put_conn(conn)
+            self._put_conn(conn, kind)
+
+    @staticmethod
+    def _fetch(cur, query: str, params: tuple = None) -> list:
+        cur.execute(query, params)
+        if cur.description:  # SELECT
+            return cur.fetchall()
+        return []
 
-    # ---------- Вспомогательный метод для as_string ----------
-    def _to_sql_string(self, sql_obj: SQL) -> str:
+    def execute_many(
+        self,
+        query: str,
+        argslist: List[tuple],
+        page_size: int = STATEMENTS_PER_ROUNDTRIP,
+    ) -> None:
         """
-        Безопасно преобразует объект SQL в строку запроса,
-        гарантированно возвращая соединение в пул.
+        Выполнить один и тот же запрос для многих наборов параметров.
+        Statement'ы склеиваются по STATEMENTS_PER_ROUNDTRIP и уходят на сервер
+        пачкой (extras.execute_batch), а не по одному round trip на строку.
         """
+        if not argslist:
+            return
         conn = self._get_conn()
         try:
-            return sql_obj.as_string(conn)
+            extras.execute_batch(
+                self._cursor(conn), query, argslist, page_size=page_size
+            )
         finally:
             self._put_conn(conn)
 
+    def _cached_sql(self, key: tuple, build) -> str:
+        """Вернуть SQL из кэша по ключу, при промахе — собрать через build()."""
+        query = self._sql_cache.get(key)
+        if query is None:
+            query = self._sql_cache[key] = build()
+        return query
+
     # ---------- Вставка данных ----------
     def insert_one(
         self,
@@ -149,25 +578,24 @@ class DBRepository:
         on_conflict: Optional[str] = None,
         conflict_target: Optional[str] = None,
     ) -> None:
-        columns = list(data.keys())
+        columns = tuple(data.keys())
         values = [data[col] for col in columns]
-        placeholders = [Placeholder()] * len(columns)
 
-        logger.info("insert_one")
-        query = SQL("INSERT INTO {} ({}) VALUES ({})").format(
-            Identifier(table),
-            SQL(", ").join(map(Identifier, columns)),
-            SQL(", ").join(placeholders),
-        )
-        if on_conflict:
-            conflict_clause = SQL(" ON CONFLICT {} {}").format(
-                SQL(conflict_target) if conflict_target else SQL(""),
-                SQL(on_conflict),
+        def build() -> str:
+            query = "INSERT INTO {} ({}) VALUES ({})".format(
+                _quote_ident(table),
+                ", ".join(map(_quote_ident, columns)),
+                ", ".join(["%s"] * len(columns)),
             )
-            query += conflict_clause
+            if on_conflict:
+                query += f" ON CONFLICT {conflict_target or ''} {on_conflict}"
+            return query
 
-        query_str = self._to_sql_string(query)
-        self.execute(query_str, tuple(values))
+        logger.info("insert_one")
+        query = self._cached_sql(
+            ("insert_one", table, columns, on_conflict, conflict_target), build
+        )
+        self.execute(query, tuple(values))
         logger.info("insert_one finished")
 
     def insert_permanent(self, record: db_schemas.PermanentUserProperties) -> None:
@@ -195,66 +623,169 @@ class DBRepository:
         if not rows:
             return [], 0
 
+        if on_conflict is None and returning_column is None:
+            # Ни ON CONFLICT, ни RETURNING не нужны — грузим одним COPY,
+            # без лимита на число параметров
+            logger.info(f"insert_batch (COPY) for {table}, total rows: {len(rows)}")
+            self._copy_batch(table, list(rows[0].keys()), rows)
+            logger.info(f"batch copied for {table}")
+            return [], 1
+
         max_rows_per_batch = self._max_rows_for_table(table)
+        logger.info(f"insert_batch for table {table}, total rows: {len(rows)}")
+
+        # Колонки, SQL и типы массивов определяются один раз на весь вызов;
+        # все батчи идут через одно соединение из пула
+        columns = list(rows[0].keys())
+        getter = _row_getter(columns)
+        array_types = self._unnest_array_types(table, columns)
+        query = self._insert_batch_sql(
+            table, columns, array_types, on_conflict, conflict_target, returning_column
+        )
+
         all_inserted_ids: List[str] = []
         batches_used = 0
-        logger.info(f"insert_batch for table {table}, total rows: {len(rows)}")
-        for i in range(0, len(rows), max_rows_per_batch):
-            chunk = rows[i : i + max_rows_per_batch]
-            ids = self._insert_batch_query(
-                table, chunk, on_conflict, conflict_target, returning_column
-            )
-            all_inserted_ids.extend(ids)
-            batches_used += 1
+        conn = self._get_conn()
+        try:
+            cur = self._cursor(conn)
+            for i in range(0, len(rows), max_rows_per_batch):
+                argslist = list(map(getter, rows[i : i + max_rows_per_batch]))
+                all_inserted_ids.extend(
+                    self._insert_batch_query(
+                        cur, query, argslist, array_types, returning_column
+                    )
+                )
+                batches_used += 1
+        finally:
+            self._put_conn(conn)
         logger.info(f"batch inserted for {table}, batches: {batches_used}")
         return all_inserted_ids, batches_used
 
-    def _insert_batch_query(
+    def _insert_batch_sql(
         self,
         table: str,
-        rows: List[Dict],
+        columns: List[str],
+        array_types: Optional[Dict[str, str]],
         on_conflict: Optional[str],
         conflict_target: Optional[str],
+        returning_column: Optional[str],
+    ) -> str:
+        """
+        Текст многострочного INSERT (кэшируется по форме запроса).
+        Если все колонки скалярные — INSERT ... SELECT * FROM UNNEST(%s::type[], ...):
+        по одному параметру-массиву на колонку, один план на любое число строк.
+        Иначе — INSERT ... VALUES %s для psycopg2.extras.execute_values.
+        """
+
+        def suffix() -> str:
+            query = ""
+            if on_conflict:
+                query += f" ON CONFLICT {conflict_target or ''} {on_conflict}"
+            if returning_column:
+                query += f" RETURNING {returning_column}"
+            return query
+
+        def build_unnest() -> str:
+            arrays = ", ".join(f"%s::{array_types[col]}[]" for col in columns)
+            return (
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"SELECT * FROM UNNEST({arrays})" + suffix()
+            )
+
+        def build_values() -> str:
+            # execute_values подставляет строки вместо единственного %s
+            return f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s" + suffix()
+
+        shape = (
+            table,
+            tuple(columns),
+            on_conflict,
+            conflict_target,
+            returning_column,
+        )
+        if array_types:
+            return self._cached_sql(("insert_unnest",) + shape, build_unnest)
+        return self._cached_sql(("insert_batch",) + shape, build_values)
+
+    @staticmethod
+    def _insert_batch_query(
+        cur,
+        query: str,
+        argslist: List[tuple],
+        array_types: Optional[Dict[str, str]],
         returning_column: Optional[str] = None,
     ) -> List[str]:
         """
-        Выполняет INSERT ... VALUES (...), (...) ...
-        Если указан returning_column — добавляет RETURNING и возвращает список значений.
-        Возвращает список строк (значения приведены к str).
+        Выполняет один многострочный INSERT (см. _insert_batch_sql).
+        Если указан returning_column — возвращает список значений (приведены к str).
         """
-        if not rows:
+        if not argslist:
             return []
 
-        columns = list(rows[0].keys())
-        value_rows = []
-        params = []
+        if array_types:
+            # Строки -> столбцы: list адаптируется psycopg2 в ARRAY
+            cur.execute(query, [list(col) for col in zip(*argslist)])
+            result = cur.fetchall() if returning_column else []
+        else:
+            # fetch=True собирает RETURNING со всех страниц
+            result = extras.execute_values(
+                cur,
+                query,
+                argslist,
+                template="(" + ", ".join(["%s"] * len(argslist[0])) + ")",
+                page_size=settings.db.max_rows_per_insert,
+                fetch=bool(returning_column),
+            )
+        if returning_column:
+            return [str(row[0]) for row in result]
+        return []
 
-        for row in rows:
-            placeholders = []
-            for col in columns:
-                params.append(row[col])
-                placeholders.append("%s")
-            value_rows.append(f"({', '.join(placeholders)})")
-
-        query = f"""
-            INSERT INTO {table} ({", ".join(columns)})
-            VALUES {", ".join(value_rows)}
+    def _unnest_array_types(
+        self, table: str, columns: List[str]
+    ) -> Optional[Dict[str, str]]:
         """
-        if on_conflict:
-            query += f" ON CONFLICT {conflict_target or ''} {on_conflict}"
-        if returning_column:
-            query += f" RETURNING {returning_column}"
+        Типы колонок таблицы (из pg_attribute, без typmod — чтобы приведение
+        массива не обрезало varchar молча) для INSERT ... FROM UNNEST.
+        None — если у таблицы нет модели или среди колонок есть не скалярные
+        (dict/list): тогда вставка идёт через execute_values.
+        """
+        if table not in self._array_types:
+            try:
+                fields = self._get_model_class(table).model_fields
+            except ValueError:
+                fields = {}
+            scalar = {
+                name
+                for name, field in fields.items()
+                if _is_scalar_annotation(field.annotation)
+            }
+            rows = self.execute(
+                """
+                SELECT attname, format_type(atttypid, NULL)
+                FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                """,
+                (table,),
+                read_only=True,
+            )
+            self._array_types[table] = {
+                name: pg_type for name, pg_type in rows if name in scalar
+            }
+        types_map = self._array_types[table]
+        if not types_map or any(col not in types_map for col in columns):
+            return None
+        return types_map
+
+    def _copy_batch(
+        self, table: str, columns: List[str], rows: List[Dict[str, Any]]
+    ) -> None:
+        """Вставка строк через COPY ... FROM STDIN (текстовый формат)."""
+        buf = io.StringIO("".join(map(_copy_text_row, map(_row_getter(columns), rows))))
+        query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
 
         conn = self._get_conn()
         try:
-            with conn.cursor() as cur:
-                cur.execute(query, params)
-                if returning_column:
-                    rows = cur.fetchall()
-                    inserted_ids = [str(row[returning_column]) for row in rows]
-                else:
-                    inserted_ids = []
-                return inserted_ids
+            self._cursor(conn).copy_expert(query, buf)
         finally:
             self._put_conn(conn)
 
@@ -263,10 +794,11 @@ class DBRepository:
         self,
         table: str,
         where: Optional[Dict[str, Any]] = None,
-        where_conditions: Optional[List[Tuple[str, str, Any]]] = None,
-        order_by: Optional[List[str]] = None,
+        where_conditions: Optional[Sequence[Tuple[str, str, Any]]] = None,
+        order_by: Optional[Sequence[str]] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
+        seek: Optional[Seek] = None,
     ) -> List[Dict[str, Any]]:
         """
         Выполняет SELECT из таблицы с возможностью фильтрации.
@@ -276,42 +808,146 @@ class DBRepository:
         :param order_by: список полей для сортировки (префикс "-" для убывания)
         :param limit: максимальное количество строк
         :param offset: смещение
+        :param seek: условие keyset-пагинации (строки после курсора)
         :return: список словарей с результатами
         """
-        query = SQL("SELECT * FROM {}").format(Identifier(table))
-        params = []
+        query, params = self._select_sql(
+            table, where, where_conditions, order_by, limit, offset, seek
+        )
+        return self.execute(query, params, dict_rows=True, read_only=True)
+
+    def iter_select(
+        self,
+        table: str,
+        where: Optional[Dict[str, Any]] = None,
+        where_conditions: Optional[Sequence[Tuple[str, str, Any]]] = None,
+        order_by: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+        itersize: int = SELECT_STREAM_ITERSIZE,
+        seek: Optional[Seek] = None,
+    ) -> "SelectStream":
+        """
+        Как select, но строки отдаются по мере чтения: именованный (серверный)
+        курсор забирает их порциями по itersize, память — O(itersize), а не O(N).
+
+        Соединение берётся и запрос объявляется (DECLARE) сразу, поэтому
+        исчерпанный пул и ошибки в запросе выбрасываются здесь, до первой строки.
+        Соединение из пула чтения занято, пока поток не исчерпан или не закрыт
+        (SelectStream.close).
+        """
+        query, params = self._select_sql(
+            table, where, where_conditions, order_by, limit, None, seek
+        )
+        conn = self._get_conn("read")
+        try:
+            # Именованный курсор работает только внутри транзакции
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                # Ограничение на каждый DECLARE/FETCH и на простой транзакции
+                # между FETCH, пока медленный клиент не дочитал ответ
+                cur.execute(
+                    "SET LOCAL statement_timeout = %s;"
+                    " SET LOCAL idle_in_transaction_session_timeout = %s",
+                    (
+                        settings.db.stream_statement_timeout_ms,
+                        settings.db.stream_idle_timeout_ms,
+                    ),
+                )
+            cur = conn.cursor(
+                name=f"{table}_stream", cursor_factory=extras.RealDictCursor
+            )
+            cur.itersize = itersize
+            cur.execute(query, params)
+        except BaseException:
+            self._end_stream(conn, failed=True)
+            raise
+        return SelectStream(self, conn, cur)
 
-        conditions = []
-        if where:
-            for col, val in where.items():
-                conditions.append(SQL("{} = %s").format(Identifier(col)))
-                params.append(val)
-        if where_conditions:
-            for col, op, val in where_conditions:
-                conditions.append(SQL("{} {} %s").format(Identifier(col), SQL(op)))
-                params.append(val)
-
-        if conditions:
-            query += SQL(" WHERE ") + SQL(" AND ").join(conditions)
-
-        if order_by:
-            order_parts = []
-            for o in order_by:
-                if o.startswith("-"):
-                    order_parts.append(SQL("{} DESC").format(Identifier(o[1:])))
+    def _end_stream(self, conn, failed: bool) -> None:
+        """Завершить транзакцию потокового SELECT и вернуть соединение в пул."""
+        try:
+            if not conn.closed:
+                if failed:
+                    conn.rollback()
                 else:
-                    order_parts.append(SQL("{} ASC").format(Identifier(o)))
-            query += SQL(" ORDER BY ") + SQL(", ").join(order_parts)
+                    conn.commit()
+        except psycopg2.Error:
+            # Сервер мог оборвать сессию по таймауту — соединение выбрасываем
+            logger.warning("Failed to finish stream transaction, closing connection")
+            conn.close()
+        finally:
+            self._put_conn(conn, "read")
+
+    def _select_sql(
+        self,
+        table: str,
+        where: Optional[Dict[str, Any]],
+        where_conditions: Optional[Sequence[Tuple[str, str, Any]]],
+        order_by: Optional[Sequence[str]],
+        limit: Optional[int],
+        offset: Optional[int],
+        seek: Optional[Seek] = None,
+    ) -> Tuple[str, tuple]:
+        """Текст SELECT (кэшируется по форме запроса) и кортеж параметров."""
+        where_cols = tuple(where) if where else ()
+        conditions = tuple((col, op) for col, op, _ in where_conditions or ())
+        order = tuple(order_by or ())
+        # Форма условия seek: при NULL в курсоре SQL другой
+        seek_shape = (
+            (seek.columns, seek.desc, seek.nullable, seek.values[0] is None)
+            if seek
+            else None
+        )
+        idents = self._col_idents.get(table, {})
+
+        def ident(col: str) -> str:
+            # Колонки моделей экранированы заранее, прочие — на лету
+            return idents.get(col) or _quote_ident(col)
 
+        def build() -> str:
+            query = f"SELECT * FROM {_quote_ident(table)}"
+            parts = [f"{ident(col)} = %s" for col in where_cols]
+            parts.extend(f"{ident(col)} {op} %s" for col, op in conditions)
+            if seek:
+                parts.append(_seek_sql(seek, ident))
+            if parts:
+                query += " WHERE " + " AND ".join(parts)
+            if order:
+                query += " ORDER BY " + ", ".join(
+                    f"{ident(o[1:])} DESC" if o.startswith("-") else f"{ident(o)} ASC"
+                    for o in order
+                )
+            if limit:
+                query += " LIMIT %s"
+            if offset:
+                query += " OFFSET %s"
+            return query
+
+        # Готовая строка SQL по «форме» запроса — без SQL.format/as_string
+        # и без соединения из пула только ради экранирования идентификаторов
+        query = self._cached_sql(
+            (
+                "select",
+                table,
+                where_cols,
+                conditions,
+                order,
+                seek_shape,
+                bool(limit),
+                bool(offset),
+            ),
+            build,
+        )
+        params = [where[col] for col in where_cols]
+        params.extend(val for _, _, val in where_conditions or ())
+        if seek:
+            # При NULL в курсоре сравнивается только первичный ключ
+            params.extend(seek.values[1:] if seek.values[0] is None else seek.values)
         if limit:
-            query += SQL(" LIMIT %s")
             params.append(limit)
         if offset:
-            query += SQL(" OFFSET %s")
             params.append(offset)
-
-        query_str = self._to_sql_string(query)
-        return self.execute(query_str, tuple(params))
+        return query, tuple(params)
 
     def get_by_pk(self, table: str, pk_column: str, pk_value: Any) -> Optional[Dict]:
         rows = self.select(table, where={pk_column: pk_value}, limit=1)
@@ -320,8 +956,27 @@ class DBRepository:
     # ---------- Специфические методы ----------
     def get_all_permanent_ehr_ids(self) -> Set[int]:
         logger.info("Fetching all ehr_id from permanent_user_properties")
-        rows = self.execute("SELECT ehr_id FROM permanent_user_properties")
-        ehr_set = {row["ehr_id"] for row in rows}
+        conn = self._get_conn("read")
+        try:
+            # Именованный (серверный) курсор работает только внутри транзакции
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SET LOCAL statement_timeout = %s", (EHR_SCAN_STATEMENT_TIMEOUT,)
+                )
+            # Строки приходят порциями по itersize, а не целиком в память клиента
+            with conn.cursor(name="ehr_scan") as cur:
+                cur.itersize = EHR_SCAN_ITERSIZE
+                cur.execute("SELECT ehr_id FROM permanent_user_properties")
+                # Вызывающий код проверяет вхождение и дополняет множество
+                # (existing_permanent.add) — поэтому set, собранный на уровне C
+                ehr_set = set(map(_FIRST_COLUMN, cur))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._put_conn(conn, "read")
         logger.info(f"Fetched {len(ehr_set)} permanent ehr_ids")
         return ehr_set
 
@@ -332,10 +987,13 @@ class DBRepository:
         """
         if not ehr_ids:
             return set()
-        placeholders = ",".join(["%s"] * len(ehr_ids))
-        query = f"SELECT ehr_id FROM permanent_user_properties WHERE ehr_id IN ({placeholders})"
-        rows = self.execute(query, tuple(ehr_ids))
-        existing = {row["ehr_id"] for row in rows}
+        # Один параметр-массив: один план на любой N и нет лимита на число параметров
+        query = (
+            "SELECT ehr_id FROM permanent_user_properties "
+            "WHERE ehr_id = ANY(%s::bigint[])"
+        )
+        rows = self.execute(query, (list(ehr_ids),), read_only=True)
+        existing = {row[0] for row in rows}
         logger.info(f"Checked {len(ehr_ids)} ehr_ids, {len(existing)} already exist")
         return existing
 
@@ -345,39 +1003,35 @@ class DBRepository:
         if not ehr_ids:
             return {}
 
+        # Один проход по ehr_ids: None отсеиваются, по разнице длин — has_null
         non_null = [eid for eid in ehr_ids if eid is not None]
-        has_null = any(eid is None for eid in ehr_ids)
+        has_null = len(non_null) != len(ehr_ids)
         result = {}
         logger.info(
             f"Fetching latest changeable for {len(non_null)} non-null ehr_ids (has_null={has_null})"
         )
+        # Обе ветки (конкретные ehr_id и ehr_id IS NULL) — одним запросом
+        # через UNION ALL: один round trip вместо двух
+        arms = []
+        params = []
         if non_null:
-            placeholders = ",".join(["%s"] * len(non_null))
-            query = f"""
-                WITH ranked AS (
-                    SELECT *,
-                           ROW_NUMBER() OVER (PARTITION BY ehr_id ORDER BY event_time DESC) AS rn
-                    FROM changeable_user_properties
-                    WHERE ehr_id IN ({placeholders})
-                )
-                SELECT * FROM ranked WHERE rn = 1
-            """
-            rows = self.execute(query, tuple(non_null))
-            for row in rows:
-                row.pop("rn", None)
-                result[row["ehr_id"]] = db_schemas.ChangeableUserProperties(**row)
-
+            # DISTINCT ON + индекс (ehr_id, event_time DESC): одна последняя строка
+            # на ehr_id без сортировки всей истории (индекс — в database_connector.md)
+            arms.append(_LATEST_CHANGEABLE_BY_EHR_SQL)
+            params.append(non_null)
         if has_null:
-            query = """
-                SELECT *
-                FROM changeable_user_properties
-                WHERE ehr_id IS NULL
-                ORDER BY event_time DESC
-                LIMIT 1
-            """
-            row = self.execute(query)
-            if row:
-                result[None] = db_schemas.ChangeableUserProperties(**row[0])
+            arms.append(_LATEST_CHANGEABLE_NULL_EHR_SQL)
+        rows = self._execute(
+            " UNION ALL ".join(arms),
+            tuple(params),
+            extras.NamedTupleCursor,
+            kind="read",
+        )
+        # Данные из БД уже типизированы (datetime, UUID через register_uuid) —
+        # валидация pydantic не нужна; строка с ehr_id IS NULL попадает в result[None]
+        construct = db_schemas.ChangeableUserProperties.model_construct
+        for row in rows:
+            result[row.ehr_id] = construct(**row._asdict())
         logger.info(f"Fetched {len(result)} latest changeable records")
         return result
 
@@ -390,12 +1044,14 @@ class DBRepository:
             return
 
         data = record.model_dump()
-        columns = list(data.keys())
-        placeholders = ["%s"] * len(columns)
-        query = f"""
-            INSERT INTO changeable_user_properties ({", ".join(columns)})
-            VALUES ({", ".join(placeholders)})
-        """
+        columns = tuple(data)
+        query = self._cached_sql(
+            ("insert_changeable", columns),
+            lambda: (
+                f"INSERT INTO changeable_user_properties ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))})"
+            ),
+        )
         self.execute(query, tuple(data.values()))
 
     def update_migrated_tmp(self, uuid: UUID, migrated: bool = True) -> None:
@@ -403,12 +1059,64 @@ class DBRepository:
         query = "UPDATE tmp_user_properties SET migrated = %s WHERE uuid = %s"
         self.execute(query, (migrated, uuid))
 
+    def enqueue_insert(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Поставить строки в буфер отложенной вставки таблицы: они уйдут в БД
+        пачкой вместе со строками других запросов (см. AsyncWriteBuffer).
+        Ошибки записи только логируются — вызывающий не ждёт результата, а
+        строки, не сброшенные до остановки процесса, теряются (режим opt-in).
+        """
+        buffer = self._insert_buffers.get(table)
+        if buffer is None:
+            with self._insert_buffers_lock:
+                buffer = self._insert_buffers.get(table)
+                if buffer is None:
+                    buffer = AsyncWriteBuffer(
+                        lambda batch: self._write_buffered_rows(table, batch),
+                        settings.db.async_insert_max_rows,
+                        settings.db.async_insert_wait_time_ms,
+                        name=f"{table}-insert-buffer",
+                    )
+                    self._insert_buffers[table] = buffer
+        for row in rows:
+            buffer.put(row)
+
+    def _write_buffered_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        # Строки разных запросов могут отличаться набором колонок (exclude_none),
+        # а insert_batch берёт колонки из первой строки — группируем по ним
+        by_columns: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_columns.setdefault(tuple(row), []).append(row)
+        for group in by_columns.values():
+            self.insert_batch(table, group)
+
+    def flush(self) -> None:
+        """Синхронно записать всё, что накоплено в буферах записи."""
+        for buffer in list(self._insert_buffers.values()):
+            buffer.flush()
+
+    def close(self) -> None:
+        """Дописать буферы и закрыть все соединения пула."""
+        for buffer in list(self._insert_buffers.values()):
+            buffer.close()
+        self.write_pool.closeall()
+        self.read_pool.closeall()
+        self._cursors.clear()
+
     def update_migrated_batch(self, uuids: List[UUID], migrated: bool = True) -> None:
         """Пометить несколько записей как обработанные (migrated = True/False) одним запросом."""
         if not uuids:
             return
-        query = "UPDATE tmp_user_properties SET migrated = %s WHERE uuid = ANY(%s)"
-        self.execute(query, (migrated, uuids))
+        if len(uuids) > MIGRATED_ANY_MAX_UUIDS:
+            # Гигантский литерал массива дорого кодировать и разбирать
+            self.execute_many(
+                "UPDATE tmp_user_properties SET migrated = %s WHERE uuid = %s",
+                [(migrated, uuid) for uuid in uuids],
+                page_size=MIGRATED_PAGE_SIZE,
+            )
+        else:
+            query = "UPDATE tmp_user_properties SET migrated = %s WHERE uuid = ANY(%s)"
+            self.execute(query, (migrated, uuids))
         logger.info(
             f"Marked {len(uuids)} records as migrated={migrated} in tmp_user_properties"
         )
@@ -431,6 +1139,6 @@ def close_repository():
     """Закрыть все соединения в пуле (вызвать при завершении приложения)."""
     global _repository_instance
     if _repository_instance:
-        _repository_instance.pool.closeall()
+        _repository_instance.close()
         _repository_instance = None
         logger.info("Closed DBRepository connection pool")
@@ -1,11 +1,61 @@
-from typing import Optional, List
+import asyncio
+import gzip
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from typing import (
+    Annotated,
+    AsyncIterator,
+    Iterator,
+    NamedTuple,
+    Optional,
+    List,
+    Tuple,
+    get_args,
+)
+
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.concurrency import iterate_in_threadpool
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+from pydantic import TypeAdapter, ValidationError
+
+try:
+    import orjson
+
+    # Ответы со списками строк рендерятся orjson вместо stdlib json.dumps
+    _DEFAULT_RESPONSE_CLASS = ORJSONResponse
+
+    def _ndjson_line(row: dict) -> bytes:
+        return orjson.dumps(row, default=str) + b"\n"
+
+except ImportError:  # orjson не установлен — обычный JSONResponse
+    _DEFAULT_RESPONSE_CLASS = JSONResponse
+
+    def _json_default(value):
+        # datetime/date — в ISO 8601, как у orjson; UUID и прочее — через str
+        return value.isoformat() if isinstance(value, (date, datetime)) else str(value)
+
+    def _ndjson_line(row: dict) -> bytes:
+        line = json.dumps(row, default=_json_default, ensure_ascii=False)
+        return (line + "\n").encode()
 
-from fastapi import APIRouter, HTTPException, Query, Depends
 
 from app.auth.deps import require_read, require_write
 from app.config.logger import get_logger
+from app.config.settings import settings
 
-from .repository import DBRepository
+from .repository import DBRepository, Seek
 from .schemas import (
     EventsPart,
     MobileDevices,
@@ -14,13 +64,6 @@ from .schemas import (
     TmpEventProperties,
     TmpUserProperties,
     UserLocations,
-    EventsPartBatch,
-    MobileDevicesBatch,
-    PermanentUserPropertiesBatch,
-    TechnicalDataBatch,
-    TmpEventPropertiesBatch,
-    TmpUserPropertiesBatch,
-    UserLocationsBatch,
     GetEventsPartResponse,
     GetMobileDevicesResponse,
     GetPermanentUserPropertiesResponse,
@@ -30,28 +73,306 @@ from .schemas import (
     GetUserLocationsResponse,
     BatchInsertResponse,
     ChangeableUserProperties,
-    ChangeableUserPropertiesBatch,
     GetChangeableUserPropertiesResponse,
 )
 
 logger = get_logger(__name__)
-router = APIRouter()
 
-# --- Dependency: DB Repository (singleton) ---
-_repo: Optional[DBRepository] = None
+# Сколько строк NDJSON склеивать в один чанк потокового ответа
+STREAM_CHUNK_ROWS = 1000
+
+# gzip для JSON-ответов: меньше — не сжимаем; compresslevel=1 — дешевле по CPU
+GZIP_MINIMUM_SIZE = 1024
+GZIP_COMPRESSLEVEL = 1
+
+
+class GZipJSONRoute(APIRoute):
+    """
+    Маршрут, сжимающий gzip готовое тело ответа, если клиент прислал
+    Accept-Encoding: gzip. Потоковые и файловые ответы (без .body) и уже
+    сжатые (с Content-Encoding) отдаются как есть; сжатие — вне event loop.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def gzip_route_handler(request: Request) -> Response:
+            response = await handler(request)
+            body = getattr(response, "body", None)
+            if (
+                not isinstance(body, bytes)
+                or len(body) < GZIP_MINIMUM_SIZE
+                or "content-encoding" in response.headers
+                or "gzip" not in request.headers.get("accept-encoding", "")
+            ):
+                return response
+            response.body = await asyncio.to_thread(
+                gzip.compress, body, GZIP_COMPRESSLEVEL
+            )
+            response.headers["content-encoding"] = "gzip"
+            response.headers["content-length"] = str(len(response.body))
+            response.headers.add_vary_header("Accept-Encoding")
+            return response
+
+        return gzip_route_handler
+
+
+router = APIRouter(
+    default_response_class=_DEFAULT_RESPONSE_CLASS, route_class=GZipJSONRoute
+)
+
 
+# --- Dependency: DB Repository ---
+def get_repo(request: Request) -> DBRepository:
+    """Общий DBRepository, созданный при старте приложения (app.state.repo)."""
+    return request.app.state.repo
+
+
+# --- Dependency: общие параметры GET-запросов ---
+class QueryOpts(NamedTuple):
+    limit: Optional[int]
+    order_by: Tuple[str, ...]
+    # Условие keyset-пагинации (строки после курсора из after / after_pk)
+    seek: Optional[Seek] = None
+    # Колонки курсора следующей страницы: (sort_by, pk) или (pk,)
+    cursor: Tuple[str, ...] = ()
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(model, column: str) -> TypeAdapter:
+    """TypeAdapter для типа колонки модели (вместе с её валидаторами)."""
+    field = model.model_fields[column]
+    annotation = field.annotation
+    if field.metadata:
+        annotation = Annotated[(annotation, *field.metadata)]
+    return TypeAdapter(annotation)
+
+
+def _cursor_param(model, column: str, value: str, param: str):
+    """Значение курсора из query-строки -> тип колонки; неверное — 400."""
+    try:
+        coerced = _field_adapter(model, column).validate_python(value)
+    except ValidationError:
+        coerced = None
+    if coerced is None:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid {param} for {column}: {value!r}"
+        )
+    return coerced
+
+
+def _query_opts_dependency(
+    model,
+    default_sort_by: Optional[str] = None,
+    default_sort_dir: str = "asc",
+    pk_column: str = "uuid",
+):
+    """
+    Зависимость, разбирающая limit / sort_by / sort_dir / after / after_pk
+    для GET-эндпоинтов по модели model. sort_dir без учёта регистра;
+    недопустимый sort_dir, неизвестная колонка или курсор не того типа — 400.
+
+    Если sort_by не первичный ключ, pk_column добавляется в ORDER BY вторым
+    ключом: порядок строк с одинаковым значением sort_by однозначен, и
+    курсор страницы — пара (after, after_pk). Если у последней строки
+    nullable-колонка sort_by пустая, курсор — только after_pk.
+    """
+    sort_by_description = "Sort field"
+    sort_dir_description = "Sort direction"
+    if default_sort_by:
+        sort_by_description += f" (default: {default_sort_by})"
+        sort_dir_description += f" (default: {default_sort_dir})"
+
+    def query_opts(
+        limit: Optional[int] = Query(None, description="Max rows to return"),
+        sort_by: Optional[str] = Query(
+            default_sort_by, description=sort_by_description
+        ),
+        sort_dir: str = Query(default_sort_dir, description=sort_dir_description),
+        after: Optional[str] = Query(
+            None,
+            description=(
+                "Keyset pagination: next_after from the previous page "
+                "(sort_by value of its last row)"
+            ),
+        ),
+        after_pk: Optional[str] = Query(
+            None,
+            description=(
+                "Keyset pagination: next_after_pk from the previous page "
+                f"({pk_column} of its last row). Required with after unless "
+                f"sort_by is {pk_column}; alone if that row's sort_by value is null"
+            ),
+        ),
+    ) -> QueryOpts:
+        sort_dir = sort_dir.lower()
+        if sort_dir not in ("asc", "desc"):
+            raise HTTPException(
+                status_code=400, detail="sort_dir must be 'asc' or 'desc'"
+            )
+        if not sort_by:
+            if after is not None or after_pk is not None:
+                raise HTTPException(status_code=400, detail="after requires sort_by")
+            return QueryOpts(limit, ())
+        if sort_by not in model.model_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown sort_by: {sort_by}")
+
+        desc = sort_dir == "desc"
+        prefix = "-" if desc else ""
+        if sort_by == pk_column:
+            if after_pk is not None and after is None:
+                raise HTTPException(status_code=400, detail="after_pk requires after")
+            order_by = (f"{prefix}{sort_by}",)
+            seek = None
+            if after is not None:
+                after_value = _cursor_param(model, sort_by, after, "after")
+                seek = Seek((sort_by,), (after_value,), desc)
+            return QueryOpts(limit, order_by, seek, (sort_by,))
+
+        # Вместо OFFSET — условие по (sort_by, pk): следующая страница берётся
+        # поиском по индексу, строки с тем же значением sort_by не теряются
+        order_by = (f"{prefix}{sort_by}", f"{prefix}{pk_column}")
+        cursor = (sort_by, pk_column)
+        if after is None and after_pk is None:
+            return QueryOpts(limit, order_by, None, cursor)
+        if after_pk is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"after requires after_pk ({pk_column} of the last row)",
+            )
+        nullable = type(None) in get_args(model.model_fields[sort_by].annotation)
+        if after is None and not nullable:
+            raise HTTPException(status_code=400, detail="after_pk requires after")
+        after_value = (
+            _cursor_param(model, sort_by, after, "after") if after is not None else None
+        )
+        pk_value = _cursor_param(model, pk_column, after_pk, "after_pk")
+        seek = Seek(cursor, (after_value, pk_value), desc, nullable)
+        return QueryOpts(limit, order_by, seek, cursor)
+
+    return query_opts
+
+
+events_query_opts = _query_opts_dependency(EventsPart)
+devices_query_opts = _query_opts_dependency(MobileDevices, pk_column="device_id")
+permanent_query_opts = _query_opts_dependency(
+    PermanentUserProperties, pk_column="ehr_id"
+)
+changeable_query_opts = _query_opts_dependency(
+    ChangeableUserProperties, "event_time", "desc"
+)
+technical_query_opts = _query_opts_dependency(TechnicalData)
+event_properties_query_opts = _query_opts_dependency(TmpEventProperties)
+user_properties_query_opts = _query_opts_dependency(TmpUserProperties)
+user_locations_query_opts = _query_opts_dependency(UserLocations)
 
-def get_repo() -> DBRepository:
-    global _repo
-    if _repo is None:
-        _repo = DBRepository()
-        logger.info("DBRepository initialized")
-    return _repo
+
+# --- Helper: blocking repository calls ---
+# psycopg2 блокирует поток, поэтому вызовы репозитория идут через asyncio.to_thread
+# и не останавливают event loop. Семафоры ограничивают число одновременных
+# вызовов размером пулов: исчерпанный пул psycopg2 не ждёт, а бросает PoolError
+_write_sem = asyncio.Semaphore(settings.db.maxconn)
+_read_sem = asyncio.Semaphore(settings.db.read_maxconn)
+
+
+async def _db_call(sem: asyncio.Semaphore, fn, *args, **kwargs):
+    async with sem:
+        return await asyncio.to_thread(fn, *args, **kwargs)
 
 
 # --- Helper: convert Pydantic model list to dict list ---
+@lru_cache(maxsize=None)
+def _list_adapter(model) -> TypeAdapter:
+    """
+    TypeAdapter(List[model]) на модель: весь список валидируется / сериализуется
+    одним вызовом pydantic-core. Для строк GET это быстрее, чем model_construct
+    в цикле на Python.
+    """
+    return TypeAdapter(List[model])
+
+
 def _models_to_dicts(models: List) -> List[dict]:
-    return [item.model_dump(exclude_none=True) for item in models]
+    if not models:
+        return []
+    # Один вызов pydantic-core на весь батч вместо model_dump на каждой строке
+    return _list_adapter(type(models[0])).dump_python(models, exclude_none=True)
+
+
+def _cursor_value(value) -> Optional[str]:
+    """Значение колонки -> строка курсора, которую примет after / after_pk."""
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, (date, datetime)) else str(value)
+
+
+def _rows_response(
+    response_cls, model, rows_data: List[dict], opts: QueryOpts
+) -> Response:
+    """
+    Ответ GET: строки валидируются одним вызовом, конверт собирается
+    model_construct и сразу сериализуется в JSON на стороне pydantic-core.
+    FastAPI не делает второй проход (dump в python-объекты + json-рендер);
+    response_model у эндпоинта остаётся для схемы OpenAPI.
+
+    Курсор следующей страницы (next_after / next_after_pk) берётся из сырой
+    последней строки, только если страница заполнена до limit.
+    """
+    rows = _list_adapter(model).validate_python(rows_data)
+    cursor = {}
+    if opts.cursor and opts.limit and len(rows_data) >= opts.limit:
+        last = rows_data[-1]
+        cursor["next_after"] = _cursor_value(last.get(opts.cursor[0]))
+        if len(opts.cursor) > 1:
+            cursor["next_after_pk"] = _cursor_value(last.get(opts.cursor[1]))
+    envelope = response_cls.model_construct(rows=rows, count=len(rows), **cursor)
+    return Response(envelope.model_dump_json(), media_type="application/json")
+
+
+async def _copy_insert(
+    repo: DBRepository, table: str, rows: List[dict], pk_column: str
+) -> BatchInsertResponse:
+    """
+    Вставка для таблиц, где первичный ключ обязателен в запросе: без ON CONFLICT
+    и RETURNING insert_batch грузит строки одним COPY. COPY вставляет либо все
+    строки, либо ни одной, поэтому вставленные ключи известны из самого запроса.
+    """
+    _, batches = await _db_call(_write_sem, repo.insert_batch, table=table, rows=rows)
+    inserted_ids = [str(row[pk_column]) for row in rows]
+    return BatchInsertResponse(
+        inserted_ids=inserted_ids,
+        count=len(inserted_ids),
+        batches=batches,
+    )
+
+
+async def _enqueue_insert(repo: DBRepository, table: str, rows: List[dict]) -> Response:
+    """
+    Отложенная вставка (X-Async-Insert: 1): строки уходят в буфер таблицы и
+    пишутся пачкой вместе со строками других запросов. Ответ — 202 без ключей
+    и без счётчика вставленных строк: на момент ответа ничего не записано.
+    """
+    # put ждёт, если буфер заполнен, — не на event loop
+    await asyncio.to_thread(repo.enqueue_insert, table, rows)
+    body = BatchInsertResponse(inserted_ids=[], count=0, batches=0, queued=True)
+    return Response(
+        body.model_dump_json(), status_code=202, media_type="application/json"
+    )
+
+
+# Общий параметр заголовка для POST с отложенной вставкой
+AsyncInsertHeader = Header(
+    False,
+    alias="X-Async-Insert",
+    description=(
+        "Queue rows for a deferred batched insert instead of writing now "
+        "(202, queued=true). Best effort: queued rows are lost if the service "
+        "stops before they are flushed, and write errors are only logged"
+    ),
+)
+
+_ASYNC_INSERT_RESPONSES = {
+    202: {"model": BatchInsertResponse, "description": "Rows queued (X-Async-Insert)"}
+}
 
 
 # =======================
@@ -61,49 +382,120 @@ def _models_to_dicts(models: List) -> List[dict]:
 
 @router.post("/events-part", response_model=BatchInsertResponse)
 async def insert_events(
-    request: EventsPartBatch,
+    data: List[EventsPart] = Body(..., embed=True),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of events into events_part table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="events_part", rows=rows, returning_column="uuid"
-    )
-
-    return BatchInsertResponse(
-        inserted_ids=inserted_ids,
-        count=len(inserted_ids),
-        batches=batches,
-    )
+    rows = _models_to_dicts(data)
+    return await _copy_insert(repo, "events_part", rows, pk_column="uuid")
 
 
 @router.get("/events-part", response_model=GetEventsPartResponse)
 async def get_events(
     pk: Optional[str] = Query(None, description="Filter by UUID"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(events_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get events from events_part table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {"uuid": pk} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "events_part",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
+    )
+    return _rows_response(GetEventsPartResponse, EventsPart, rows_data, opts)
+
+
+def _ndjson_chunks(rows) -> Iterator[bytes]:
+    """Строки -> NDJSON, склеенный в чанки по STREAM_CHUNK_ROWS строк."""
+    chunk = []
+    for row in rows:
+        chunk.append(_ndjson_line(row))
+        if len(chunk) >= STREAM_CHUNK_ROWS:
+            yield b"".join(chunk)
+            chunk.clear()
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _discard_opening_stream(opening: asyncio.Future) -> None:
+    """
+    Done-callback для iter_select, ожидание которого отменили: закрыть
+    открытый поток (commit — в потоке, не на loop) и освободить слот _read_sem.
+    """
+    if opening.cancelled() or opening.exception() is not None:
+        _read_sem.release()
+        return
+    closing = asyncio.get_running_loop().run_in_executor(None, opening.result().close)
+    closing.add_done_callback(lambda _: _read_sem.release())
 
-    rows_data = repo.select("events_part", where=where, order_by=order_by, limit=limit)
-    rows = [EventsPart(**row) for row in rows_data]
 
-    return GetEventsPartResponse(rows=rows, count=len(rows))
+@router.get("/events-part/stream")
+async def stream_events(
+    pk: Optional[str] = Query(None, description="Filter by UUID"),
+    opts: QueryOpts = Depends(events_query_opts),
+    repo: DBRepository = Depends(get_repo),
+    user=Depends(require_read),
+):
+    """
+    Stream events from events_part table as NDJSON (one JSON object per line).
+    Rows are read through a server-side cursor, so memory stays bounded for any limit.
+    """
+    where = {"uuid": pk} if pk else None
+    # Слот семафора и соединение берутся до ответа: исчерпанный пул или ошибка
+    # в запросе дают статус ошибки, а не оборванное тело после 200
+    await _read_sem.acquire()
+    opening = asyncio.ensure_future(
+        asyncio.to_thread(
+            repo.iter_select,
+            "events_part",
+            where=where,
+            seek=opts.seek,
+            order_by=opts.order_by,
+            limit=opts.limit,
+        )
+    )
+    try:
+        # shield: при отмене запроса поток всё равно дойдёт до конца и вернёт
+        # SelectStream с соединением — его закроет _discard_opening_stream
+        rows = await asyncio.shield(opening)
+    except asyncio.CancelledError:
+        opening.add_done_callback(_discard_opening_stream)
+        raise
+    except BaseException:
+        _read_sem.release()
+        raise
+
+    released = False
+
+    async def release() -> None:
+        # Вызывается и из генератора, и фоновой задачей ответа (если поток
+        # так и не начали читать) — освобождаем ровно один раз
+        nonlocal released
+        if not released:
+            released = True
+            await asyncio.to_thread(rows.close)
+            _read_sem.release()
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in iterate_in_threadpool(_ndjson_chunks(rows)):
+                yield chunk
+        finally:
+            await release()
+
+    return StreamingResponse(
+        body(), media_type="application/x-ndjson", background=BackgroundTask(release)
+    )
 
 
 # =======================
@@ -113,51 +505,37 @@ async def get_events(
 
 @router.post("/mobile-devices", response_model=BatchInsertResponse)
 async def insert_devices(
-    request: MobileDevicesBatch,
+    data: List[MobileDevices] = Body(..., embed=True),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of devices into mobile_devices table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="mobile_devices", rows=rows, returning_column="device_id"
-    )
-
-    return BatchInsertResponse(
-        inserted_ids=inserted_ids,
-        count=len(inserted_ids),
-        batches=batches,
-    )
+    rows = _models_to_dicts(data)
+    return await _copy_insert(repo, "mobile_devices", rows, pk_column="device_id")
 
 
 @router.get("/mobile-devices", response_model=GetMobileDevicesResponse)
 async def get_devices(
     pk: Optional[str] = Query(None, description="Filter by device_id"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(devices_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get devices from mobile_devices table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {"device_id": pk} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "mobile_devices", where=where, order_by=order_by, limit=limit
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "mobile_devices",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
     )
-    rows = [MobileDevices(**row) for row in rows_data]
-
-    return GetMobileDevicesResponse(rows=rows, count=len(rows))
+    return _rows_response(GetMobileDevicesResponse, MobileDevices, rows_data, opts)
 
 
 # =======================
@@ -167,16 +545,18 @@ async def get_devices(
 
 @router.post("/permanent-user-properties", response_model=BatchInsertResponse)
 async def insert_user_properties(
-    request: PermanentUserPropertiesBatch,
+    data: List[PermanentUserProperties] = Body(..., embed=True),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of records into permanent_user_properties table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
+    rows = _models_to_dicts(data)
+    inserted_ids, batches = await _db_call(
+        _write_sem,
+        repo.insert_batch,
         table="permanent_user_properties",
         rows=rows,
         on_conflict="DO NOTHING",
@@ -195,39 +575,44 @@ async def insert_user_properties(
     "/permanent-user-properties", response_model=GetPermanentUserPropertiesResponse
 )
 async def get_user_properties(
-    pk: Optional[str] = Query(None, description="Filter by ehr_id"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    pk: Optional[int] = Query(None, description="Filter by ehr_id"),
+    opts: QueryOpts = Depends(permanent_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from permanent_user_properties table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
-    where = {"ehr_id": int(pk)} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "permanent_user_properties", where=where, order_by=order_by, limit=limit
+    # pk типизирован как int: нечисловое значение — 422, а не ValueError -> 500
+    where = {"ehr_id": pk} if pk is not None else None
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "permanent_user_properties",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
+    )
+    return _rows_response(
+        GetPermanentUserPropertiesResponse, PermanentUserProperties, rows_data, opts
     )
-    rows = [PermanentUserProperties(**row) for row in rows_data]
-
-    return GetPermanentUserPropertiesResponse(rows=rows, count=len(rows))
 
 
 # =======================
 # changeable_data endpoints
 # =======================
 
+# ON CONFLICT по ehr_id (только для не-NULL): обновляются все колонки, кроме ehr_id.
+# Строка постоянная — собирается один раз при импорте
+_CHANGEABLE_ON_CONFLICT = "DO UPDATE SET " + ", ".join(
+    f"{col} = EXCLUDED.{col}"
+    for col in ChangeableUserProperties.model_fields
+    if col != "ehr_id"
+)
+
 
 @router.post("/changeable-user-properties", response_model=BatchInsertResponse)
 async def insert_changeable_user_properties(
-    request: ChangeableUserPropertiesBatch,
+    data: List[ChangeableUserProperties] = Body(..., embed=True),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
@@ -237,24 +622,17 @@ async def insert_changeable_user_properties(
     Rows with ehr_id = NULL are always inserted.
     Returns list of inserted/updated UUIDs.
     """
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
+    rows = _models_to_dicts(data)
 
-    # ON CONFLICT по ehr_id (только для не-NULL)
-    set_clause = ", ".join(
-        [
-            f"{col} = EXCLUDED.{col}"
-            for col in ChangeableUserProperties.model_fields.keys()
-            if col != "ehr_id"
-        ]
-    )
-
-    inserted_ids, batches = repo.insert_batch(
+    inserted_ids, batches = await _db_call(
+        _write_sem,
+        repo.insert_batch,
         table="changeable_user_properties",
         rows=rows,
-        on_conflict=f"DO UPDATE SET {set_clause}",
+        on_conflict=_CHANGEABLE_ON_CONFLICT,
         conflict_target="(ehr_id)",
         returning_column="uuid",  # ✅ возвращаем UUID, а не id
     )
@@ -272,40 +650,29 @@ async def insert_changeable_user_properties(
 async def get_changeable_user_properties(
     uuid: Optional[str] = Query(None, description="Filter by UUID (exact match)"),
     ehr_id: Optional[int] = Query(None, description="Filter by ehr_id"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(
-        "event_time", description="Sort field (default: event_time)"
-    ),
-    sort_dir: str = Query(
-        "desc", description="Sort direction (default: desc for latest first)"
-    ),
+    opts: QueryOpts = Depends(changeable_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from changeable_user_properties table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {}
     if uuid:
         where["uuid"] = uuid
     if ehr_id is not None:
         where["ehr_id"] = ehr_id
 
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
         "changeable_user_properties",
         where=where or None,
-        order_by=order_by,
-        limit=limit,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
+    )
+    return _rows_response(
+        GetChangeableUserPropertiesResponse, ChangeableUserProperties, rows_data, opts
     )
-    rows = [ChangeableUserProperties(**row) for row in rows_data]
-
-    return GetChangeableUserPropertiesResponse(rows=rows, count=len(rows))
 
 
 # =======================
@@ -313,53 +680,46 @@ async def get_changeable_user_properties(
 # =======================
 
 
-@router.post("/technical-data", response_model=BatchInsertResponse)
+@router.post(
+    "/technical-data",
+    response_model=BatchInsertResponse,
+    responses=_ASYNC_INSERT_RESPONSES,
+)
 async def insert_technical_data(
-    request: TechnicalDataBatch,
+    data: List[TechnicalData] = Body(..., embed=True),
+    async_insert: bool = AsyncInsertHeader,
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of records into technical_data table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="technical_data", rows=rows, returning_column="uuid"
-    )
-
-    return BatchInsertResponse(
-        inserted_ids=inserted_ids,
-        count=len(inserted_ids),
-        batches=batches,
-    )
+    rows = _models_to_dicts(data)
+    if async_insert:
+        return await _enqueue_insert(repo, "technical_data", rows)
+    return await _copy_insert(repo, "technical_data", rows, pk_column="uuid")
 
 
 @router.get("/technical-data", response_model=GetTechnicalDataResponse)
 async def get_technical_data(
     pk: Optional[str] = Query(None, description="Filter by UUID"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(technical_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from technical_data table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {"uuid": pk} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "technical_data", where=where, order_by=order_by, limit=limit
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "technical_data",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
     )
-    rows = [TechnicalData(**row) for row in rows_data]
-
-    return GetTechnicalDataResponse(rows=rows, count=len(rows))
+    return _rows_response(GetTechnicalDataResponse, TechnicalData, rows_data, opts)
 
 
 # =======================
@@ -367,19 +727,30 @@ async def get_technical_data(
 # =======================
 
 
-@router.post("/event-properties", response_model=BatchInsertResponse)
+@router.post(
+    "/event-properties",
+    response_model=BatchInsertResponse,
+    responses=_ASYNC_INSERT_RESPONSES,
+)
 async def insert_event_properties(
-    request: TmpEventPropertiesBatch,
+    data: List[TmpEventProperties] = Body(..., embed=True),
+    async_insert: bool = AsyncInsertHeader,
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of records into tmp_event_properties table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="tmp_event_properties", rows=rows, returning_column="uuid"
+    rows = _models_to_dicts(data)
+    if async_insert:
+        return await _enqueue_insert(repo, "tmp_event_properties", rows)
+    inserted_ids, batches = await _db_call(
+        _write_sem,
+        repo.insert_batch,
+        table="tmp_event_properties",
+        rows=rows,
+        returning_column="uuid",
     )
 
     return BatchInsertResponse(
@@ -392,28 +763,24 @@ async def insert_event_properties(
 @router.get("/event-properties", response_model=GetEventPropertiesResponse)
 async def get_event_properties(
     pk: Optional[str] = Query(None, description="Filter by UUID"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(event_properties_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from tmp_event_properties table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {"uuid": pk} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "tmp_event_properties", where=where, order_by=order_by, limit=limit
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "tmp_event_properties",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
+    )
+    return _rows_response(
+        GetEventPropertiesResponse, TmpEventProperties, rows_data, opts
     )
-    rows = [TmpEventProperties(**row) for row in rows_data]
-
-    return GetEventPropertiesResponse(rows=rows, count=len(rows))
 
 
 # =======================
@@ -421,19 +788,30 @@ async def get_event_properties(
 # =======================
 
 
-@router.post("/user-properties", response_model=BatchInsertResponse)
+@router.post(
+    "/user-properties",
+    response_model=BatchInsertResponse,
+    responses=_ASYNC_INSERT_RESPONSES,
+)
 async def insert_user_properties_batch(
-    request: TmpUserPropertiesBatch,
+    data: List[TmpUserProperties] = Body(..., embed=True),
+    async_insert: bool = AsyncInsertHeader,
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of records into tmp_user_properties table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="tmp_user_properties", rows=rows, returning_column="uuid"
+    rows = _models_to_dicts(data)
+    if async_insert:
+        return await _enqueue_insert(repo, "tmp_user_properties", rows)
+    inserted_ids, batches = await _db_call(
+        _write_sem,
+        repo.insert_batch,
+        table="tmp_user_properties",
+        rows=rows,
+        returning_column="uuid",
     )
 
     return BatchInsertResponse(
@@ -446,34 +824,28 @@ async def insert_user_properties_batch(
 @router.get("/user-properties", response_model=GetUserPropertiesResponse)
 async def get_user_properties_tmp(
     pk: Optional[str] = Query(None, description="Filter by UUID"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(user_properties_query_opts),
     migrated: Optional[bool] = Query(None, description="Filter by migrated flag"),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from tmp_user_properties table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {}
     if pk:
         where["uuid"] = pk
     if migrated is not None:
         where["migrated"] = migrated
 
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "tmp_user_properties", where=where, order_by=order_by, limit=limit
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "tmp_user_properties",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
     )
-    rows = [TmpUserProperties(**row) for row in rows_data]
-
-    return GetUserPropertiesResponse(rows=rows, count=len(rows))
+    return _rows_response(GetUserPropertiesResponse, TmpUserProperties, rows_data, opts)
 
 
 # =======================
@@ -481,50 +853,43 @@ async def get_user_properties_tmp(
 # =======================
 
 
-@router.post("/user-locations", response_model=BatchInsertResponse)
+@router.post(
+    "/user-locations",
+    response_model=BatchInsertResponse,
+    responses=_ASYNC_INSERT_RESPONSES,
+)
 async def insert_user_locations(
-    request: UserLocationsBatch,
+    data: List[UserLocations] = Body(..., embed=True),
+    async_insert: bool = AsyncInsertHeader,
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_write),
 ):
     """Insert batch of records into user_locations table."""
-    if not request.data:
+    if not data:
         raise HTTPException(status_code=400, detail="data array cannot be empty")
 
-    rows = _models_to_dicts(request.data)
-    inserted_ids, batches = repo.insert_batch(
-        table="user_locations", rows=rows, returning_column="uuid"
-    )
-
-    return BatchInsertResponse(
-        inserted_ids=inserted_ids,
-        count=len(inserted_ids),
-        batches=batches,
-    )
+    rows = _models_to_dicts(data)
+    if async_insert:
+        return await _enqueue_insert(repo, "user_locations", rows)
+    return await _copy_insert(repo, "user_locations", rows, pk_column="uuid")
 
 
 @router.get("/user-locations", response_model=GetUserLocationsResponse)
 async def get_user_locations(
     pk: Optional[str] = Query(None, description="Filter by UUID"),
-    limit: Optional[int] = Query(None, description="Max rows to return"),
-    sort_by: Optional[str] = Query(None, description="Sort field"),
-    sort_dir: str = Query("asc", description="Sort direction"),
+    opts: QueryOpts = Depends(user_locations_query_opts),
     repo: DBRepository = Depends(get_repo),
     user=Depends(require_read),
 ):
     """Get records from user_locations table."""
-    if sort_dir.lower() not in ("asc", "desc"):
-        raise HTTPException(status_code=400, detail="sort_dir must be 'asc' or 'desc'")
-
     where = {"uuid": pk} if pk else None
-    order_by = []
-    if sort_by:
-        prefix = "-" if sort_dir.lower() == "desc" else ""
-        order_by.append(f"{prefix}{sort_by}")
-
-    rows_data = repo.select(
-        "user_locations", where=where, order_by=order_by, limit=limit
+    rows_data = await _db_call(
+        _read_sem,
+        repo.select,
+        "user_locations",
+        where=where,
+        seek=opts.seek,
+        order_by=opts.order_by,
+        limit=opts.limit,
     )
-    rows = [UserLocations(**row) for row in rows_data]
-
-    return GetUserLocationsResponse(rows=rows, count=len(rows))
+    return _rows_response(GetUserLocationsResponse, UserLocations, rows_data, opts)
@@ -1,9 +1,30 @@
 from datetime import datetime
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, Dict, Any, List
+from pydantic import BaseModel, BeforeValidator, Field
+from typing import Optional, Dict, Any, List, Annotated
 from uuid import UUID
 
 
+def parse_iso_datetime(v: Any) -> Any:
+    """
+    Общая проверка event_time: принимаются только строки ISO 8601 и datetime.
+    Строку разбирает datetime.fromisoformat (суффикс Z — UTC), а не
+    pydantic-core: тот принял бы и числовую строку как unix timestamp.
+    """
+    if v is None or isinstance(v, datetime):
+        return v
+    if isinstance(v, str):
+        try:
+            return datetime.fromisoformat(v.replace("Z", "+00:00"))
+        except ValueError:
+            pass
+    raise ValueError(
+        f"Invalid datetime format for event_time: '{v}'. Expected ISO 8601."
+    )
+
+
+IsoDatetime = Annotated[datetime, BeforeValidator(parse_iso_datetime)]
+
+
 # =======================
 # Request Schemas (POST)
 # =======================
@@ -12,7 +33,7 @@ from uuid import UUID
 class EventsPart(BaseModel):
     uuid: UUID
     event_type: Optional[str] = None
-    event_time: Optional[datetime] = None
+    event_time: Optional[IsoDatetime] = None
     user_id: Optional[int] = None
     platform: Optional[str] = None
     device_id: Optional[str] = None
@@ -24,21 +45,6 @@ class EventsPart(BaseModel):
     start_version: Optional[str] = None
     version_name: Optional[str] = None
 
-    @field_validator("event_time", mode="before")
-    @classmethod
-    def parse_event_time(cls, v):
-        """Строго преобразует строку в datetime. Если формат неверный — ValueError."""
-        if v is None:
-            return v
-        if isinstance(v, datetime):
-            return v
-        try:
-            return datetime.fromisoformat(v.replace("Z", "+00:00"))
-        except (ValueError, TypeError) as e:
-            raise ValueError(
-                f"Invalid datetime format for event_time: '{v}'. Expected ISO 8601."
-            ) from e
-
 
 class MobileDevices(BaseModel):
     device_id: str
@@ -64,7 +70,7 @@ class PermanentUserProperties(BaseModel):
 class ChangeableUserProperties(BaseModel):
     ehr_id: Optional[int] = None
     uuid: UUID
-    event_time: datetime  # обязательное поле
+    event_time: IsoDatetime  # обязательное поле
     language: Optional[str] = None
     age: Optional[int] = None
     app_city: Optional[str] = None
@@ -81,19 +87,6 @@ class ChangeableUserProperties(BaseModel):
     session_id: Optional[int] = None
     start_version: Optional[str] = None
 
-    @field_validator("event_time", mode="before")
-    @classmethod
-    def parse_event_time(cls, v):
-        """Обязательное поле: строго преобразует строку в datetime."""
-        if isinstance(v, datetime):
-            return v
-        try:
-            return datetime.fromisoformat(v.replace("Z", "+00:00"))
-        except (ValueError, TypeError, AttributeError) as e:
-            raise ValueError(
-                f"Invalid datetime format for event_time: '{v}'. Expected ISO 8601."
-            ) from e
-
 
 class TechnicalData(BaseModel):
     uuid: UUID
@@ -119,22 +112,7 @@ class TmpUserProperties(BaseModel):
     session_id: Optional[int] = None
     start_version: Optional[str] = None
     migrated: Optional[bool] = None
-    event_time: Optional[datetime] = None
-
-    @field_validator("event_time", mode="before")
-    @classmethod
-    def parse_event_time(cls, v):
-        """Если поле присутствует, оно должно быть валидным datetime или None."""
-        if v is None:
-            return v
-        if isinstance(v, datetime):
-            return v
-        try:
-            return datetime.fromisoformat(v.replace("Z", "+00:00"))
-        except (ValueError, TypeError) as e:
-            raise ValueError(
-                f"Invalid datetime format for event_time: '{v}'. Expected ISO 8601."
-            ) from e
+    event_time: Optional[IsoDatetime] = None
 
 
 class UserLocations(BaseModel):
@@ -151,40 +129,65 @@ class UserLocations(BaseModel):
 # Response Schemas (GET)
 # =======================
 
+# Курсор следующей страницы (keyset-пагинация): null, если страница неполная
+# или sort_by не задан
+NextAfter = Annotated[
+    Optional[str],
+    Field(description="Pass as after to get the next page (sort_by of the last row)"),
+]
+NextAfterPk = Annotated[
+    Optional[str],
+    Field(description="Pass as after_pk to get the next page (pk of the last row)"),
+]
+
 
 class GetEventsPartResponse(BaseModel):
     rows: List[EventsPart]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetMobileDevicesResponse(BaseModel):
     rows: List[MobileDevices]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetPermanentUserPropertiesResponse(BaseModel):
     rows: List[PermanentUserProperties]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetTechnicalDataResponse(BaseModel):
     rows: List[TechnicalData]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetEventPropertiesResponse(BaseModel):
     rows: List[TmpEventProperties]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetUserPropertiesResponse(BaseModel):
     rows: List[TmpUserProperties]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 class GetUserLocationsResponse(BaseModel):
     rows: List[UserLocations]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
 
 
 # =======================
@@ -202,45 +205,9 @@ class BatchInsertResponse(BaseModel):
     )
     count: int = Field(..., description="Total number of rows inserted")
     batches: int = Field(..., description="Number of batches used")
-
-
-# =======================
-# Batch Request Wrappers
-# =======================
-
-
-class EventsPartBatch(BaseModel):
-    data: List[EventsPart]
-
-
-class MobileDevicesBatch(BaseModel):
-    data: List[MobileDevices]
-
-
-class PermanentUserPropertiesBatch(BaseModel):
-    data: List[PermanentUserProperties]
-
-
-class TechnicalDataBatch(BaseModel):
-    data: List[TechnicalData]
-
-
-class TmpEventPropertiesBatch(BaseModel):
-    data: List[TmpEventProperties]
-
-
-class TmpUserPropertiesBatch(BaseModel):
-    data: List[TmpUserProperties]
-
-
-class UserLocationsBatch(BaseModel):
-    data: List[UserLocations]
-
-
-class ChangeableUserPropertiesBatch(BaseModel):
-    """Batch request for changeable_user_properties."""
-
-    data: List[ChangeableUserProperties]
+    queued: bool = Field(
+        False, description="Rows were queued for a deferred batched insert"
+    )
 
 
 class GetChangeableUserPropertiesResponse(BaseModel):
@@ -248,3 +215,5 @@ class GetChangeableUserPropertiesResponse(BaseModel):
 
     rows: List[ChangeableUserProperties]
     count: int
+    next_after: NextAfter = None
+    next_after_pk: NextAfterPk = None
@@ -1,15 +1,26 @@
-import json
-from typing import Dict, List, Optional, Set, Any, Tuple
+import collections
+import itertools
+import multiprocessing
+import operator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Any, Tuple
 from uuid import UUID
 from datetime import datetime, timedelta
 from fastapi import HTTPException
 
-from app.etl.transformer import transform_single_record, SourceType
+from app.etl.transformer import (
+    transform_single_record,
+    transform_amplitude_line,
+    transform_amplitude_lines,
+    SourceType,
+    TransformResult,
+)
 from app.db.schemas import (
     PermanentUserProperties,
     ChangeableUserProperties,
 )
 from app.db.repository import get_repository
+from app.s3.client import S3Client
 from app.config.settings import settings
 from app.config.logger import get_logger
 
@@ -21,18 +32,21 @@ def log_bads(errors: List[Dict[str, Any]]):
         logger.error("Transformation error: %s", err)
 
 
+# Поля, изменение которых означает новую версию changeable-записи:
+# кортеж значений собирается одним вызовом attrgetter (на C)
+_CHANGEABLE_CMP_GETTER = operator.attrgetter(
+    *(
+        f
+        for f in ChangeableUserProperties.model_fields
+        if f not in {"uuid", "event_time", "session_id"}
+    )
+)
+
+
 def compare_changeable(
     old: Optional[ChangeableUserProperties], new: ChangeableUserProperties
 ) -> bool:
-    if old is None:
-        return True
-
-    exclude = {"uuid", "event_time", "session_id"}
-    return any(
-        getattr(old, f) != getattr(new, f)
-        for f in ChangeableUserProperties.model_fields
-        if f not in exclude
-    )
+    return old is None or _CHANGEABLE_CMP_GETTER(old) != _CHANGEABLE_CMP_GETTER(new)
 
 
 class ProcessingInterrupted(Exception):
@@ -48,23 +62,111 @@ class ProcessingInterrupted(Exception):
         super().__init__(message)
 
 
+class LatestChangeableCache:
+    """
+    Последняя changeable-запись по ehr_id, подгружаемая из БД лениво.
+
+    Вместо предзагрузки по всем ehr_id на старте неизвестные ehr_id добираются
+    одним запросом на батч (prefetch) и запоминаются — в том числе отсутствие
+    записи, чтобы не ходить в БД за тем же ehr_id повторно.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._data: Dict[Optional[int], Optional[ChangeableUserProperties]] = {}
+
+    def prefetch(self, ehr_ids) -> None:
+        """Загрузить одним запросом ещё не известные ehr_id."""
+        missing = list({eid for eid in ehr_ids if eid not in self._data})
+        if not missing:
+            return
+        found = self._repo.get_latest_changeable_for_ehrs(missing)
+        for eid in missing:
+            self._data[eid] = found.get(eid)
+
+    def get(self, ehr_id: Optional[int]) -> Optional[ChangeableUserProperties]:
+        if ehr_id not in self._data:
+            self.prefetch((ehr_id,))
+        return self._data[ehr_id]
+
+    def __setitem__(
+        self, ehr_id: Optional[int], record: ChangeableUserProperties
+    ) -> None:
+        self._data[ehr_id] = record
+
+
+def _iter_transformed_lines(
+    lines: Iterator[str],
+) -> Iterator[Optional[TransformResult]]:
+    """
+    transform_amplitude_line для каждой строки, в исходном порядке.
+
+    При settings.etl.transform_workers > 0 разбор и трансформация идут в пуле
+    процессов чанками по transform_chunk_size строк. В работе не больше двух
+    чанков на процесс, так что файл по-прежнему читается потоково.
+    """
+    workers = settings.etl.transform_workers
+    if workers <= 0:
+        yield from map(transform_amplitude_line, lines)
+        return
+
+    chunk_size = settings.etl.transform_chunk_size
+    chunks = iter(lambda: list(itertools.islice(lines, chunk_size)), [])
+    # spawn: форк процесса с пулом соединений и фоновыми потоками небезопасен
+    executor = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(transform_amplitude_lines, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _LineReader:
+    """
+    Итератор строк, который при ошибке чтения не бросает исключение, а
+    заканчивается и сохраняет его в error; count — число прочитанных строк.
+    """
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self.count = 0
+        self.error: Optional[Exception] = None
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for line in self._lines:
+                self.count += 1
+                yield line
+        except Exception as e:
+            logger.error(f"Failed to read line {self.count} from S3: {e}")
+            self.error = e
+
+
+# Сколько ошибок трансформации перечислять в сообщении
+MAX_ERRORS_TO_SHOW = 2
+
+
 def _format_transform_error(errors: List[Dict[str, Any]]) -> str:
     """
-    Берёт первую ошибку из списка transform_errors и возвращает читаемое сообщение.
-    Если ошибок несколько, добавляет информацию о количестве.
+    Берёт первые ошибки из списка transform_errors и возвращает читаемое сообщение.
+    Если ошибок больше MAX_ERRORS_TO_SHOW, добавляет информацию о количестве.
     """
     if not errors:
         return "Неизвестная ошибка трансформации"
 
-    MAX_ERRORS_TO_SHOW = 2
-    details = []
-    for i, e in enumerate(errors[:MAX_ERRORS_TO_SHOW]):
-        key = e.get("key", "<неизвестный ключ>")
-        value = e.get("value", "<неизвестное значение>")
-        reason = e.get("reason", "без причины")
-        details.append(f"'{key}' = {value} ({reason})")
-
-    msg = "; ".join(details)
+    msg = "; ".join(
+        f"'{e.get('key', '<неизвестный ключ>')}' = "
+        f"{e.get('value', '<неизвестное значение>')} "
+        f"({e.get('reason', 'без причины')})"
+        for e in errors[:MAX_ERRORS_TO_SHOW]
+    )
     if len(errors) > MAX_ERRORS_TO_SHOW:
         msg += f" и ещё {len(errors) - MAX_ERRORS_TO_SHOW} ошибка(ок)"
     return f"Ошибка трансформации: {msg}"
@@ -79,12 +181,8 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
     existing_permanent: Set[int] = repo.get_all_permanent_ehr_ids()
     logger.info(f"Loaded {len(existing_permanent)} existing permanent ehr_ids")
 
-    logger.info("Preloading latest changeable records...")
-    all_ehr_for_change = list(existing_permanent) + [None]
-    last_change: Dict[Optional[int], ChangeableUserProperties] = (
-        repo.get_latest_changeable_for_ehrs(all_ehr_for_change)
-    )
-    logger.info(f"Loaded {len(last_change)} latest changeable records")
+    # Последние changeable-записи подгружаются по мере появления ehr_id
+    last_change = LatestChangeableCache(repo)
 
     processed_total = 0
     errors_total = 0
@@ -130,6 +228,8 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
 
             # --- Вставка changeable ---
             if pending_changeable:
+                # Неизвестные ehr_id батча — одним запросом, а не по одному
+                last_change.prefetch(c["ehr_id"] for c in pending_changeable)
                 to_insert = []
                 for c in pending_changeable:
                     eid = c["ehr_id"]
@@ -154,51 +254,64 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
 
         try:
             if source_type == "amplitude":
-                # rows_or_lines — это список строк файла
-                for line_idx, line in enumerate(rows_or_lines):
-                    try:
-                        raw_record = json.loads(line.strip())
-                    except json.JSONDecodeError as e:
-                        flush()
-                        raise ProcessingInterrupted(
-                            f"Невалидный JSON на строке {line_idx}",
-                            last_successful_line=line_idx - 1,
-                            failed_line=line_idx,
-                            file_key=kwargs.get("file_key"),
-                        )
-
-                    permanent, changeable, transform_errors = transform_single_record(
-                        raw_record, source_type="amplitude"
-                    )
-
-                    if transform_errors:
-                        log_bads(transform_errors)
-                        flush()
-                        error_msg = _format_transform_error(transform_errors)
-                        raise ProcessingInterrupted(
-                            error_msg,
-                            last_successful_line=line_idx - 1,
-                            failed_line=line_idx,
-                            file_key=kwargs.get("file_key"),
-                        )
-
-                    if permanent:
-                        pending_permanent.append(permanent.model_dump())
-                    if changeable:
-                        pending_changeable.append(changeable.model_dump())
-
-                    processed_total += 1
-
-                    if (
-                        len(pending_permanent) >= batch_size
-                        or len(pending_changeable) >= batch_size
+                # rows_or_lines — итератор строк файла, начиная со start_line;
+                # номера строк — сквозные по файлу. Результаты трансформации
+                # приходят в порядке строк (возможно, из пула процессов)
+                results = _iter_transformed_lines(iter(rows_or_lines))
+                try:
+                    for line_idx, result in enumerate(
+                        results, start=kwargs.get("start_line", 0)
                     ):
-                        flush()
+                        if result is None:
+                            flush()
+                            raise ProcessingInterrupted(
+                                f"Невалидный JSON на строке {line_idx}",
+                                last_successful_line=line_idx - 1,
+                                failed_line=line_idx,
+                                file_key=kwargs.get("file_key"),
+                            )
+
+                        permanent, changeable, transform_errors = result
+
+                        if transform_errors:
+                            log_bads(transform_errors)
+                            flush()
+                            error_msg = _format_transform_error(transform_errors)
+                            raise ProcessingInterrupted(
+                                error_msg,
+                                last_successful_line=line_idx - 1,
+                                failed_line=line_idx,
+                                file_key=kwargs.get("file_key"),
+                            )
+
+                        if permanent:
+                            pending_permanent.append(permanent.model_dump())
+                        if changeable:
+                            pending_changeable.append(changeable.model_dump())
+
+                        processed_total += 1
+
+                        if (
+                            len(pending_permanent) >= batch_size
+                            or len(pending_changeable) >= batch_size
+                        ):
+                            flush()
+                finally:
+                    # Останавливает пул процессов, не дожидаясь лишних чанков
+                    results.close()
 
                 flush()
                 return
 
             elif source_type == "tmp_table":
+
+                def flush_migrated():
+                    """flush() и одним UPDATE ... = ANY помечаем записанные строки."""
+                    flush()
+                    if batch_uuids:
+                        repo.update_migrated_batch(batch_uuids, migrated=True)
+                        batch_uuids.clear()
+
                 # rows_or_lines — это список записей из БД за день
                 for row in rows_or_lines:
                     raw_record = dict(row)
@@ -209,7 +322,7 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
 
                     if transform_errors:
                         log_bads(transform_errors)
-                        flush()
+                        flush_migrated()
                         error_msg = _format_transform_error(transform_errors)
                         raise ProcessingInterrupted(
                             f"Ошибка трансформации для записи {raw_record.get('uuid')}: {error_msg}"
@@ -226,15 +339,11 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
                     if (
                         len(pending_permanent) >= batch_size
                         or len(pending_changeable) >= batch_size
+                        or len(batch_uuids) >= batch_size
                     ):
-                        flush()
-                        if batch_uuids:
-                            repo.update_migrated_batch(batch_uuids, migrated=True)
-                            batch_uuids.clear()
+                        flush_migrated()
 
-                flush()
-                if batch_uuids:
-                    repo.update_migrated_batch(batch_uuids, migrated=True)
+                flush_migrated()
 
         except Exception as e:
             # Любая ошибка внутри дня прерывает весь процесс
@@ -243,36 +352,57 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
 
     try:
         if source_type == "amplitude":
-            from app.s3.client import S3Client
-
             s3 = S3Client()
             bucket = params["bucket"]
             prefix = params["prefix"]
             start_after_idx = int(params.get("start_after", 0))
 
             try:
-                content = s3.get_object(bucket, prefix).decode("utf-8")
-                lines = content.splitlines()
-                logger.info(f"Loaded file {prefix} from S3, {len(lines)} lines")
+                # Файл читается потоково: в памяти только текущий чанк, а не весь
+                # файл и список его строк
+                lines = s3.iter_lines(prefix, bucket=bucket)
+                logger.info(f"Streaming file {prefix} from S3")
             except Exception as e:
                 raise ProcessingInterrupted(
                     f"Не удалось прочитать файл S3: {str(e)}", file_key=prefix
                 )
 
-            if start_after_idx >= len(lines):
+            # Ошибка чтения посреди потока не обрывает обработку строк, уже
+            # прочитанных (в т.ч. ушедших в пул процессов): reader просто
+            # заканчивается, а ошибка поднимается после flush в process_day
+            reader = _LineReader(lines)
+            line_iter = iter(reader)
+
+            # Пропускаем уже обработанные строки, считая их
+            skipped = sum(1 for _ in itertools.islice(line_iter, start_after_idx))
+            first_line = next(line_iter, None)
+            if first_line is None and reader.error is None:
                 logger.info("Start index beyond file length, nothing to process")
                 return {
                     "processed": 0,
                     "errors": 0,
-                    "last_successful_line": str(len(lines) - 1),
+                    "last_successful_line": str(skipped - 1),
                 }
 
-            process_day(
-                day_date=datetime.now(),
-                rows_or_lines=lines[start_after_idx:],
-                source_type="amplitude",
-                file_key=prefix,
-            )
+            if first_line is not None:
+                process_day(
+                    day_date=datetime.now(),
+                    rows_or_lines=itertools.chain((first_line,), line_iter),
+                    source_type="amplitude",
+                    file_key=prefix,
+                    start_line=start_after_idx,
+                )
+
+            if reader.error is not None:
+                # Первая непрочитанная строка (не раньше точки возобновления)
+                failed_line = max(reader.count, start_after_idx)
+                raise ProcessingInterrupted(
+                    f"Ошибка чтения файла S3 на строке {failed_line}: "
+                    f"{str(reader.error)}",
+                    last_successful_line=failed_line - 1,
+                    failed_line=failed_line,
+                    file_key=prefix,
+                )
             logger.info(f"Amplitude ETL finished. Total processed: {processed_total}")
 
         elif source_type == "tmp_table":
@@ -291,7 +421,12 @@ def process_source(source_type: SourceType, params: Dict[str, Any]) -> Dict[str,
                       AND event_time < %s
                     ORDER BY event_time
                 """
-                rows = repo.execute(query, (False, current_day, next_day))
+                rows = repo.execute(
+                    query,
+                    (False, current_day, next_day),
+                    dict_rows=True,
+                    read_only=True,
+                )
                 logger.info(f"Selected {len(rows)} rows for day {current_day.date()}")
 
                 if not rows:
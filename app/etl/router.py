@@ -62,7 +62,7 @@ async def amplitude_to_s3_export(request: ExportRequest, user=Depends(require_wr
         ndjson_name = f"{week_key}.ndjson"
 
         # Create ZIP with one .ndjson file
-        zip_path = await create_ndjson_zip(lines_iterator, archive_name, ndjson_name)
+        zip_path = await create_ndjson_zip(lines_iterator, ndjson_name)
 
         try:
             with open(zip_path, "rb") as f:
@@ -1,3 +1,4 @@
+import json
 import re
 from uuid import UUID
 from datetime import datetime
@@ -10,10 +11,21 @@ from app.db.schemas import (
 from app.etl import MAPPINGS
 from app.config.logger import get_logger
 
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # orjson не установлен — используем stdlib json
+    _json_loads = json.loads
+
 logger = get_logger(__name__)
 
 SourceType = Literal["amplitude", "tmp_table"]
 
+TransformResult = Tuple[
+    Optional[PermanentUserProperties], Optional[ChangeableUserProperties], List[Dict]
+]
+
 
 def safe_dict(value):
     """Возвращает словарь, если value — dict, иначе пустой dict."""
@@ -238,3 +250,22 @@ def transform_single_record(
         changeable = None
 
     return permanent, changeable, errors
+
+
+def transform_amplitude_line(line: str) -> Optional[TransformResult]:
+    """
+    Разобрать строку Amplitude-файла и трансформировать запись.
+    Возвращает None, если строка — невалидный JSON.
+    """
+    try:
+        # orjson.JSONDecodeError — подкласс json.JSONDecodeError;
+        # пробелы и перевод строки по краям парсер пропускает сам
+        raw_record = _json_loads(line)
+    except json.JSONDecodeError:
+        return None
+    return transform_single_record(raw_record, source_type="amplitude")
+
+
+def transform_amplitude_lines(lines: List[str]) -> List[Optional[TransformResult]]:
+    """Пакетный transform_amplitude_line: задача пула процессов на чанк строк."""
+    return [transform_amplitude_line(line) for line in lines]
@@ -0,0 +1,32 @@
+import httpx
+
+from app.config.logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- Глобальный HTTP-клиент ----------
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий httpx.AsyncClient (синглтон) с пулом keep-alive соединений,
+    чтобы не платить за TCP/TLS-рукопожатие на каждый запрос.
+    Таймауты задаются на уровне конкретного запроса.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=32),
+        )
+        logger.info("Created shared httpx.AsyncClient")
+    return _http_client
+
+
+async def close_http_client():
+    """Закрыть общий HTTP-клиент (вызвать при завершении приложения)."""
+    global _http_client
+    if _http_client:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Closed shared httpx.AsyncClient")
@@ -9,7 +9,8 @@ from app.s3.router import router as s3_router
 from app.amplitude.router import router as amplitude_router
 from app.etl.router import router as etl_router
 from app.yandex_metrika.router import router as yandex_metrika_router
-from app.db.repository import close_repository
+from app.db.repository import close_repository, get_repository
+from app.http_client import close_http_client
 
 configure_logging(level=settings.logging.level)
 logger = get_logger(__name__)
@@ -28,6 +29,9 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting %s v%s", settings.title, settings.version)
+    # Один DBRepository (и один набор пулов) на всё приложение: его же
+    # используют ETL и Метрика через get_repository()
+    app.state.repo = get_repository()
 
 
 @app.get("/health", tags=["Main"])
@@ -35,6 +39,12 @@ async def root():
     return {"app": settings.title, "version": settings.version, "status": "running"}
 
 
+@app.get("/health/db", tags=["Main"])
+async def db_health():
+    """Занятость пулов соединений к БД (чтение / запись)."""
+    return {"pools": app.state.repo.pool_stats()}
+
+
 app.include_router(amplitude_router, prefix="/amplitude", tags=["Amplitude"])
 app.include_router(appmetrica_router, prefix="/appmetrica", tags=["AppMetrica"])
 app.include_router(
@@ -48,4 +58,5 @@ app.include_router(s3_router, prefix="/s3", tags=["S3"])
 @app.on_event("shutdown")
 async def shutdown_event():
     close_repository()
-    logger.info("Application shutdown, DB connection pool closed")
+    await close_http_client()
+    logger.info("Application shutdown, DB connection pool and HTTP client closed")
@@ -1,16 +1,21 @@
 """AWS S3 client for managing object storage operations."""
 
+import gzip
+
 import boto3
 import logging
 from botocore.config import Config
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 
 from app.config.settings import settings
 from app.config.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Размер чанка при потоковом чтении объекта построчно
+STREAM_CHUNK_SIZE = 1 << 20
+
 
 class S3Client:
     def __init__(self):
@@ -115,6 +120,37 @@ class S3Client:
         logger.info(f"Downloaded {key}, size: {len(data)} bytes")
         return data
 
+    def iter_lines(self, key: str, bucket: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream object as text lines without loading it into memory.
+
+        The request is sent immediately (missing key raises here), the body is
+        read in STREAM_CHUNK_SIZE chunks while iterating. Keys ending with .gz
+        are decompressed on the fly.
+
+        Args:
+            key: S3 object key/path
+            bucket: Bucket name (defaults to the configured bucket)
+
+        Returns:
+            Iterator over decoded lines (line endings are not guaranteed to be kept)
+        """
+        logger.info(f"Streaming S3 object: {key}")
+        response = self.client_v4.get_object(Bucket=bucket or self.bucket, Key=key)
+        return self._iter_body_lines(response["Body"], key.endswith(".gz"))
+
+    @staticmethod
+    def _iter_body_lines(body, gzipped: bool) -> Iterator[str]:
+        try:
+            if gzipped:
+                lines = gzip.GzipFile(fileobj=body)
+            else:
+                lines = body.iter_lines(chunk_size=STREAM_CHUNK_SIZE)
+            for line in lines:
+                yield line.decode("utf-8")
+        finally:
+            body.close()
+
     def put_object(
         self, key: str, data: bytes, content_type: Optional[str] = None
     ) -> Dict[str, Any]:
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from typing import Any, Dict, List
 
 
@@ -13,12 +14,10 @@ from app.yandex_metrika.schemas import (
     PageTransition,
     ProcessDayResponse,
 )
-from app.db.repository import DBRepository
+from app.db.repository import get_repository
 from app.etl.services import remove_query_params, is_url_target
 from app.config.settings import settings
 
-repository = DBRepository()
-
 
 def get_earliest_visit(ym_raw_data: list[MetrikaHitRow]) -> list[MetricaAdData]:
     """Группирует по client_id и сохраняет самый первый вход на сайт и маркетинговые данные"""
@@ -161,8 +160,6 @@ def get_user_paths(
             visits_first_hit[row.visit_id] = row
 
     # Группируем по client_id
-    from collections import defaultdict
-
     visits_by_client = defaultdict(list)
     for row in visits_first_hit.values():
         visits_by_client[row.client_id].append(row)
@@ -369,6 +366,9 @@ async def get_ad_efficiency(
 ) -> ProcessDayResponse:
     statistics = {}
 
+    # Общий DBRepository приложения (те же пулы, что у app.state.repo)
+    repository = get_repository()
+
     # Получить сырые данные
     ym_raw_data: list[MetrikaHitRow] = await get_metrika_hits(
         token=token,
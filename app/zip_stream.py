@@ -0,0 +1,187 @@
+"""
+Потоковая упаковка в ZIP одного файла для ответов API.
+
+Архив с одним файлом известного размера собирается вручную (struct), большие
+архивы (ZIP64) и сжатие без libdeflate — через zipfile. CPU-ёмкая работа
+(CRC, DEFLATE) выполняется в потоках через asyncio.to_thread.
+"""
+
+import asyncio
+import io
+import os
+import stat
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from typing import AsyncGenerator
+
+try:
+    # libdeflate: DEFLATE в 2–3 раза быстрее zlib, но без потокового режима
+    import deflate
+except ImportError:  # не установлен — сжимаем через zipfile/zlib
+    deflate = None
+
+# Размер порции данных при потоковой отдаче архива
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Максимальный размер файла для архива без ZIP64: размеры и смещение
+# центрального каталога — 32 бита. Запас 1 MiB — под заголовки и худший
+# случай расширения DEFLATE на несжимаемых данных
+ZIP32_MAX_CONTENT = 0xFFFFFFFF - (1 << 20)
+
+# version made by: старший байт 3 — Unix (иначе unzip игнорирует права файла),
+# младший 20 — версия спецификации 2.0
+_VERSION_MADE_BY = (3 << 8) | 20
+
+
+def zip_options(compress: bool) -> dict:
+    """
+    Параметры ZipFile: по умолчанию без сжатия (ZIP_STORED), при compress=True —
+    DEFLATE с уровнем 1 (быстро, с приемлемой степенью сжатия).
+    """
+    if compress:
+        return {"compression": zipfile.ZIP_DEFLATED, "compresslevel": 1}
+    return {"compression": zipfile.ZIP_STORED}
+
+
+class ZipSink(io.RawIOBase):
+    """Приёмник без seek для ZipFile: копит записанные байты до вызова drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _dos_datetime(ts: float) -> tuple:
+    t = time.localtime(ts)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _single_file_zip(
+    filename: str, payload: bytes, crc: int, size: int, method: int
+) -> tuple:
+    """
+    Заголовки ZIP с одним файлом: локальный заголовок (до payload) и
+    центральный каталог + end of central directory (после payload).
+
+    payload уже сжат методом method; размеры должны помещаться в 32 бита.
+    """
+    name = filename.encode("utf-8")
+    dos_time, dos_date = _dos_datetime(time.time())
+    flags = 0x0800  # имя файла в UTF-8
+    local_header = struct.pack(
+        "<4s5H3L2H",
+        b"PK\x03\x04",
+        20,
+        flags,
+        method,
+        dos_time,
+        dos_date,
+        crc,
+        len(payload),
+        size,
+        len(name),
+        0,
+    )
+    central_dir = struct.pack(
+        "<4s6H3L5H2L",
+        b"PK\x01\x02",
+        _VERSION_MADE_BY,
+        20,
+        flags,
+        method,
+        dos_time,
+        dos_date,
+        crc,
+        len(payload),
+        size,
+        len(name),
+        0,
+        0,
+        0,
+        0,
+        (stat.S_IFREG | 0o644) << 16,
+        0,
+    )
+    end_of_central_dir = struct.pack(
+        "<4s4H2LH",
+        b"PK\x05\x06",
+        0,
+        0,
+        1,
+        1,
+        len(central_dir) + len(name),
+        len(local_header) + len(name) + len(payload),
+        0,
+    )
+    return local_header + name, central_dir + name + end_of_central_dir
+
+
+def _libdeflate_compress(content: bytes) -> tuple:
+    """Сжать content целиком через libdeflate (raw DEFLATE), вернуть (данные, crc)."""
+    return deflate.deflate_compress(content, 1), zlib.crc32(content)
+
+
+async def stream_zip(
+    filename: str, content: bytes, compress: bool = False
+) -> AsyncGenerator[bytes, None]:
+    """Отдаёт ZIP с одним файлом по частям, не собирая весь архив в памяти."""
+    # Один файл известного размера: заголовки ZIP собираем вручную (struct),
+    # без zipfile. Только для архивов с 32-битными размерами и смещениями,
+    # иначе — zipfile с ZIP64
+    if len(content) <= ZIP32_MAX_CONTENT and (not compress or deflate is not None):
+        if compress:
+            # Данные уже целиком в памяти, поэтому однопроходный libdeflate подходит
+            payload, crc = await asyncio.to_thread(_libdeflate_compress, content)
+            method = zipfile.ZIP_DEFLATED
+        else:
+            # zlib.crc32 отпускает GIL — считаем в потоке, не блокируя event loop
+            payload, crc = content, await asyncio.to_thread(zlib.crc32, content)
+            method = zipfile.ZIP_STORED
+        head, tail = _single_file_zip(filename, payload, crc, len(content), method)
+        yield head
+        view = memoryview(payload)
+        for i in range(0, len(view), STREAM_CHUNK_SIZE):
+            yield view[i : i + STREAM_CHUNK_SIZE].tobytes()
+        yield tail
+        return
+
+    sink = ZipSink()
+    view = memoryview(content)
+    with zipfile.ZipFile(sink, "w", **zip_options(compress)) as zip_file:
+        with zip_file.open(filename, "w", force_zip64=True) as entry:
+            for i in range(0, len(view), STREAM_CHUNK_SIZE):
+                # CRC/DEFLATE — блокирующая работа, выносим её из event loop
+                await asyncio.to_thread(entry.write, view[i : i + STREAM_CHUNK_SIZE])
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+    yield sink.drain()
+
+
+def zip_file(path: str, arcname: str, compress: bool = False) -> str:
+    """Упаковать файл в ZIP во временном файле и вернуть путь к архиву."""
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
+    tmp.close()
+    try:
+        with zipfile.ZipFile(tmp.name, "w", **zip_options(compress)) as zip_file:
+            zip_file.write(path, arcname=arcname)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+    return tmp.name
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.auth import deps
+from app.auth.schemas import User
+
+USER = User(login="analyst", access="read")
+
+
+class _Clock:
+    """Подменяет time в app.auth.deps: monotonic и time двигаются вместе."""
+
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(deps, "time", clock)
+    monkeypatch.setattr(deps, "_auth_cache", {})
+    monkeypatch.setattr(deps, "_auth_locks", {})
+    return clock
+
+
+def test_cache_hit_until_ttl(clock):
+    key = deps._token_key("token")
+    deps._cache_put(key, USER, exp=clock.now + 3600)
+
+    clock.now += deps.AUTH_CACHE_TTL - 1
+    assert deps._cache_get(key) == USER
+
+    clock.now += 1
+    assert deps._cache_get(key) is None
+    assert key not in deps._auth_cache
+
+
+def test_cache_ttl_capped_by_jwt_exp(clock):
+    key = deps._token_key("token")
+    deps._cache_put(key, USER, exp=clock.now + 10)
+
+    clock.now += 9
+    assert deps._cache_get(key) == USER
+    clock.now += 1
+    assert deps._cache_get(key) is None
+
+
+def test_cache_skips_expired_jwt(clock):
+    key = deps._token_key("token")
+    deps._cache_put(key, USER, exp=clock.now)
+
+    assert deps._auth_cache == {}
+
+
+def test_cache_evicts_oldest_entry(clock, monkeypatch):
+    monkeypatch.setattr(deps, "AUTH_CACHE_MAXSIZE", 2)
+    keys = [deps._token_key(f"token-{i}") for i in range(3)]
+    for key in keys:
+        deps._cache_put(key, USER, exp=clock.now + 3600)
+
+    assert list(deps._auth_cache) == keys[1:]
+
+
+def test_get_current_user_authenticates_token_once(clock, monkeypatch):
+    calls = []
+
+    async def authenticate(oauth_token, client):
+        calls.append(oauth_token)
+        await asyncio.sleep(0)
+        return USER, clock.now + 3600
+
+    monkeypatch.setattr(deps, "_authenticate", authenticate)
+    monkeypatch.setattr(deps, "get_http_client", lambda: None)
+    credentials = SimpleNamespace(credentials="token")
+
+    async def run():
+        return await asyncio.gather(
+            *(deps.get_current_user(None, credentials) for _ in range(5))
+        )
+
+    # Параллельные промахи ждут один запрос в Яндекс, следующий — из кэша
+    assert asyncio.run(run()) == [USER] * 5
+    assert asyncio.run(run()) == [USER] * 5
+    assert calls == ["token"]
+    assert deps._auth_locks == {}
@@ -0,0 +1,217 @@
+import json
+import threading
+from datetime import date, datetime
+from uuid import UUID
+
+import pytest
+
+from app.db.repository import (
+    AsyncWriteBuffer,
+    DBRepository,
+    Seek,
+    _copy_array_literal,
+    _copy_scalar,
+    _copy_text_row,
+)
+
+
+@pytest.fixture
+def repo() -> DBRepository:
+    # Только построение SQL: без пулов и соединений
+    repo = DBRepository.__new__(DBRepository)
+    repo._col_idents = {}
+    repo._sql_cache = {}
+    return repo
+
+
+def test_select_sql_seek_single_column(repo):
+    query, params = repo._select_sql(
+        "events_part", None, None, ("uuid",), 10, None, Seek(("uuid",), ("u1",))
+    )
+
+    assert query == (
+        'SELECT * FROM "events_part" WHERE "uuid" > %s ORDER BY "uuid" ASC LIMIT %s'
+    )
+    assert params == ("u1", 10)
+
+
+def test_select_sql_seek_row_comparison_desc(repo):
+    seek = Seek(("event_time", "uuid"), ("2024-01-01", "u1"), desc=True)
+    query, params = repo._select_sql(
+        "events_part",
+        {"platform": "ios"},
+        None,
+        ("-event_time", "-uuid"),
+        None,
+        None,
+        seek,
+    )
+
+    assert query == (
+        'SELECT * FROM "events_part" WHERE "platform" = %s'
+        ' AND ("event_time", "uuid") < (%s, %s)'
+        ' ORDER BY "event_time" DESC, "uuid" DESC'
+    )
+    assert params == ("ios", "2024-01-01", "u1")
+
+
+def _seek_sql(repo, seek: Seek):
+    return repo._select_sql("events_part", None, None, None, None, None, seek)
+
+
+@pytest.mark.parametrize(
+    "desc, after, condition, params",
+    [
+        (
+            False,
+            "t",
+            '(("event_time", "uuid") > (%s, %s) OR "event_time" IS NULL)',
+            ("t", "u1"),
+        ),
+        (False, None, '("event_time" IS NULL AND ("uuid") > (%s))', ("u1",)),
+        (True, "t", '("event_time", "uuid") < (%s, %s)', ("t", "u1")),
+        (True, None, '("event_time" IS NOT NULL OR ("uuid") < (%s))', ("u1",)),
+    ],
+)
+def test_select_sql_seek_nullable_sort_column(repo, desc, after, condition, params):
+    seek = Seek(("event_time", "uuid"), (after, "u1"), desc=desc, nullable=True)
+    query, query_params = _seek_sql(repo, seek)
+
+    assert query == f'SELECT * FROM "events_part" WHERE {condition}'
+    assert query_params == params
+
+
+def test_select_sql_cache_keeps_null_cursor_shape_apart(repo):
+    columns = ("event_time", "uuid")
+    with_value = _seek_sql(repo, Seek(columns, ("t", "u1"), nullable=True))
+    with_null = _seek_sql(repo, Seek(columns, (None, "u1"), nullable=True))
+
+    assert with_value[0] != with_null[0]
+    assert with_null[1] == ("u1",)
+
+
+def _parse_copy_row(line: str) -> list:
+    """Обратное преобразование строки COPY (текстовый формат) — для проверок."""
+    assert line.endswith("\n")
+    unescape = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+    fields = []
+    for field in line[:-1].split("\t"):
+        if field == "\\N":
+            fields.append(None)
+            continue
+        chars = iter(field)
+        fields.append("".join(unescape[next(chars)] if c == "\\" else c for c in chars))
+    return fields
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (True, "t"),
+        (False, "f"),
+        (0, "0"),
+        (1.5, "1.5"),
+        (datetime(2024, 1, 2, 3, 4, 5), "2024-01-02T03:04:05"),
+        (date(2024, 1, 2), "2024-01-02"),
+        (UUID(int=1), "00000000-0000-0000-0000-000000000001"),
+        ("plain", "plain"),
+    ],
+)
+def test_copy_scalar(value, expected):
+    assert _copy_scalar(value) == expected
+
+
+@pytest.mark.parametrize(
+    "values, expected",
+    [
+        ([], "{}"),
+        (["a", "b"], '{"a","b"}'),
+        (["a,b", 'say "hi"', None], '{"a,b","say \\"hi\\"",NULL}'),
+        (["back\\slash", "{brace}"], '{"back\\\\slash","{brace}"}'),
+        ([1, None, 3], '{"1",NULL,"3"}'),
+        ([[1, 2], [3, None]], '{{"1","2"},{"3",NULL}}'),
+    ],
+)
+def test_copy_array_literal(values, expected):
+    assert _copy_array_literal(values) == expected
+
+
+def test_copy_text_row_escapes_special_characters():
+    values = ("tab\there", "new\nline", "cr\rhere", "back\\slash", "\\N", None, "")
+    line = _copy_text_row(values)
+
+    # Ровно 7 полей: табы и переводы строк внутри значений экранированы
+    assert line.count("\t") == len(values) - 1
+    assert line.count("\n") == 1
+    # Строка "\N" отличается от NULL
+    assert line.split("\t")[4] == "\\\\N"
+    assert line.split("\t")[5] == "\\N"
+    assert _parse_copy_row(line) == list(values)
+
+
+def test_copy_text_row_json_and_arrays_round_trip():
+    payload = {"key": "tab\tand \"quotes\"", "path": "C:\\tmp", "n": [1, None]}
+    tags = ["a,b", 'q"uote', "back\\slash", None]
+    fields = _parse_copy_row(_copy_text_row((payload, tags, UUID(int=2))))
+
+    assert json.loads(fields[0]) == payload
+    assert fields[1] == _copy_array_literal(tags)
+    assert fields[2] == str(UUID(int=2))
+
+
+class _Recorder:
+    def __init__(self, fail_first: bool = False):
+        self.batches = []
+        self._fail = fail_first
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: list) -> None:
+        with self._lock:
+            if self._fail:
+                self._fail = False
+                raise RuntimeError("db is down")
+            self.batches.append(list(batch))
+
+    @property
+    def rows(self) -> list:
+        return sorted(row for batch in self.batches for row in batch)
+
+
+def test_async_write_buffer_flush_writes_everything_in_batches():
+    recorder = _Recorder()
+    buffer = AsyncWriteBuffer(recorder, max_rows=10, wait_time_ms=50, name="test")
+    try:
+        for row in range(25):
+            buffer.put(row)
+        buffer.flush()
+
+        assert recorder.rows == list(range(25))
+        assert all(len(batch) <= 10 for batch in recorder.batches)
+    finally:
+        buffer.close()
+
+
+def test_async_write_buffer_close_writes_remainder_and_stops():
+    recorder = _Recorder()
+    buffer = AsyncWriteBuffer(recorder, max_rows=100, wait_time_ms=50, name="test")
+    for row in range(5):
+        buffer.put(row)
+    buffer.close()
+
+    assert recorder.rows == list(range(5))
+    assert not buffer._thread.is_alive()
+
+
+def test_async_write_buffer_write_error_does_not_block_flush():
+    recorder = _Recorder(fail_first=True)
+    buffer = AsyncWriteBuffer(recorder, max_rows=10, wait_time_ms=50, name="test")
+    try:
+        buffer.put("lost")
+        buffer.flush()
+        buffer.put("kept")
+        buffer.flush()
+
+        # Ошибка записи только логируется: пачка теряется, буфер работает дальше
+        assert recorder.rows == ["kept"]
+    finally:
+        buffer.close()
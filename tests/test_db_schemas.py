@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.db.schemas import EventsPart
+
+UUID = "00000000-0000-0000-0000-000000000001"
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2024-01-01T10:00:00Z", datetime(2024, 1, 1, 10, tzinfo=timezone.utc)),
+        ("2024-01-01T10:00:00+00:00", datetime(2024, 1, 1, 10, tzinfo=timezone.utc)),
+        ("2024-01-01 10:00:00", datetime(2024, 1, 1, 10)),
+        (None, None),
+    ],
+)
+def test_event_time_accepts_iso_8601(value, expected):
+    assert EventsPart(uuid=UUID, event_time=value).event_time == expected
+
+
+@pytest.mark.parametrize("value", ["1700000000", 1700000000, 1.5, "yesterday", ""])
+def test_event_time_rejects_timestamps_and_garbage(value):
+    with pytest.raises(ValidationError):
+        EventsPart(uuid=UUID, event_time=value)
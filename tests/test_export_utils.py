@@ -0,0 +1,52 @@
+import asyncio
+import os
+import zipfile
+
+import pytest
+
+from app.amplitude import export_utils
+
+
+async def _lines(lines):
+    for line in lines:
+        yield line
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+def test_create_ndjson_zip_round_trip(monkeypatch, compression):
+    # Маленький буфер — несколько записей в архив до последней
+    monkeypatch.setattr(export_utils, "WRITE_BUFFER_SIZE", 64)
+    lines = [b'{"event_id": %d}' % i for i in range(100)]
+    expected = b"".join(line + b"\n" for line in lines)
+
+    path = asyncio.run(
+        export_utils.create_ndjson_zip(_lines(lines), "day.ndjson", compression)
+    )
+    try:
+        with zipfile.ZipFile(path) as archive:
+            assert archive.testzip() is None
+            assert archive.read("day.ndjson") == expected
+    finally:
+        os.remove(path)
+
+
+def test_create_ndjson_zip_removes_file_on_error(monkeypatch):
+    created = []
+    original = export_utils.tempfile.NamedTemporaryFile
+
+    def named_temporary_file(*args, **kwargs):
+        tmp = original(*args, **kwargs)
+        created.append(tmp.name)
+        return tmp
+
+    async def failing():
+        yield b"{}"
+        raise RuntimeError("export failed")
+
+    monkeypatch.setattr(
+        export_utils.tempfile, "NamedTemporaryFile", named_temporary_file
+    )
+    with pytest.raises(RuntimeError):
+        asyncio.run(export_utils.create_ndjson_zip(failing(), "day.ndjson"))
+
+    assert created and not os.path.exists(created[0])
@@ -0,0 +1,49 @@
+import asyncio
+import io
+import stat
+import zipfile
+
+import pytest
+
+from app import zip_stream
+
+
+def _build_zip(filename: str, content: bytes, compress: bool) -> bytes:
+    async def collect() -> bytes:
+        chunks = zip_stream.stream_zip(filename, content, compress)
+        return b"".join([chunk async for chunk in chunks])
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("content", [b"", b'{"data": []}', bytes(range(256)) * 5000])
+def test_stream_zip_round_trip(content, compress):
+    data = _build_zip("appmetrica_resp.json", content, compress)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["appmetrica_resp.json"]
+        assert archive.read("appmetrica_resp.json") == content
+
+
+def test_stream_zip_unix_mode():
+    data = _build_zip("appmetrica_resp.json", b"{}", compress=False)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        (info,) = archive.infolist()
+        assert info.create_system == 3
+        mode = info.external_attr >> 16
+        assert stat.S_ISREG(mode)
+        assert stat.S_IMODE(mode) == 0o644
+
+
+def test_stream_zip_falls_back_to_zip64(monkeypatch):
+    # Файл больше лимита 32-битного архива уходит в zipfile с ZIP64
+    monkeypatch.setattr(zip_stream, "ZIP32_MAX_CONTENT", 10)
+    content = b"x" * 100
+    data = _build_zip("appmetrica_resp.json", content, compress=False)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.read("appmetrica_resp.json") == content